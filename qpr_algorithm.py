@@ -2,6 +2,7 @@
 
 
 import numpy as np
+import timeit
 import qpr_fundamentials as fun
 
 def calc_r(u, L):   # calculate r
@@ -38,7 +39,7 @@ def calc_fmin(aQ, u):
     dotprod = np.dot(aQ, u)
     return aQ_norm2 - np.power(dotprod, 2)
 
-def qp_relax(h, P, Ku, L):
+def qp_relax(h, P, Ku, L, quant="loop", stats=None):
     """
     Implementation of the proposed algorithm by [ZM15].
     Returns a tuple with the calculated computation rate and the integer valued coefficient vector aQ.
@@ -53,7 +54,14 @@ def qp_relax(h, P, Ku, L):
         upper bound for K (maximal possible value in aQ)
     L: int
         length of channel vector/ aQ (=number of senders in the system)
+    quant: string
+        quantization mode, "loop": one k after another, "block": all k at once (see quantize_block),
+        "pruned"/"pruned_sorted": skip k which cannot improve fmin (see quantize_pruned)
+    stats: relax_stats
+        collects counters and phase timings if given (None: no instrumentation)
     """
+    if stats is not None:
+        t0 = timeit.default_timer()
     K   = 0   # K
     Kl  = 0  # running K
     d   = 0.0
@@ -74,6 +82,10 @@ def qp_relax(h, P, Ku, L):
     aC1 = init_aC(L, r) # normalized initial a
     aC = np.zeros(L)    # used to test k*aC1
     
+    if stats is not None:
+        t1 = timeit.default_timer()
+        stats.time['sort'] += t1 - t0
+    
     """ DETERMINE K """
     if fun.nf(Ku, aC1) < b:
         K = Ku
@@ -85,9 +97,16 @@ def qp_relax(h, P, Ku, L):
                 Kl = K
             else:
                 Ku = K
+            if stats is not None:
+                stats.bisection_steps += 1
 
         K = Kl
     
+    if stats is not None:
+        t2 = timeit.default_timer()
+        stats.time['K'] += t2 - t1
+        stats.add_K(K)
+    
     """ Quantization """
     aQ = np.zeros(L, dtype=np.int)
     aQ[L-1] = 1
@@ -102,51 +121,590 @@ def qp_relax(h, P, Ku, L):
     else: 
         k_range = range(1, K+1)
     
-    for k in k_range:
-        aC = k * aC1
-        d = np.dot(aC, u)
+    if quant == "block":
+        aQ, fmin = quantize_block(aC1, u, K, L, aQ, fmin, stats)
+    elif quant in ["pruned", "pruned_sorted"]:
+        aQ, fmin = quantize_pruned(aC1, u, K, L, aQ, fmin, stats, quant == "pruned_sorted")
+    else:
+        u2 = _pow2(u)
+        for k in k_range:
+            aC = k * aC1
         
-        """ QUESTION:   
-        paper:      for l <-1 to L-1
-        in python:  range(0, L) ? or range(0, L-1) 
+            """ QUESTION:   
+            paper:      for l <-1 to L-1
+            in python:  range(0, L) ? or range(0, L-1) 
         
-        alg     python
-        1       0
-        2       1
-        3       2
-        …       …
-        L-1     L-2
-        L       L-1     range(0, L)   = 0, 1, 2 … L-1       L=4:    0,1,2,3
-                        range(0, L-1) = 0, 1, 2 … L-1-1     L=4:    0,1,2
-                        """
-        for l in range(0, L-1):    # 1 -> L-1
-            v =  aC[l]
-            aC[l] = np.floor( aC[l] )
-            d += (aC[l] - v) * u[l]
-            # calculate condition term
-            x = (2*aC[l]) - 2*d*u[l] + 1 - u[l]**2
-
-            if x<0:
-                aC[l] += 1
-                d += u[l]
-#            print "l={}, aC={}, x<0={}".format(l, aC, x<0)
-        f = fun.norm2(aC) - np.power(d, 2)
+            alg     python
+            1       0
+            2       1
+            3       2
+            …       …
+            L-1     L-2
+            L       L-1     range(0, L)   = 0, 1, 2 … L-1       L=4:    0,1,2,3
+                            range(0, L-1) = 0, 1, 2 … L-1-1     L=4:    0,1,2
+                            """
+            f = _quantize_scaled(aC, u, L, stats, u2)   # 1 -> L-1
         
-#        print "\tR={0}, Rmax={1}, Rref={2}".format(comp_rate(f), comp_rate(fmin), fun.comp_rate(h_abs_sorted, aC, P))
-#        print "\tk={}, fmin={}, f={}, aQ={}".format(k, fmin, f, aQ)
-        if f<fmin:  # the less fmin, the bigger compRate
-            aQ = np.copy(aC)
-            fmin = f
+    #        print "\tR={0}, Rmax={1}, Rref={2}".format(comp_rate(f), comp_rate(fmin), fun.comp_rate(h_abs_sorted, aC, P))
+    #        print "\tk={}, fmin={}, f={}, aQ={}".format(k, fmin, f, aQ)
+            if f<fmin:  # the less fmin, the bigger compRate
+                aQ = np.copy(aC)
+                fmin = f
+                if stats is not None:
+                    stats.add_improvement(k)
+            if stats is not None:
+                stats.k_evals += 1
         
+    if stats is not None:
+        t3 = timeit.default_timer()
+        stats.time['quant'] += t3 - t2
+    
     # recover coefficient vector
     for l in range(0,L):
         sign = t[p[l]]
         a[p[l]] = sign * aQ[l]
 
     compRate = comp_rate(fmin)   # computation rate
+    if stats is not None:
+        stats.time['sign'] += timeit.default_timer() - t3
+        stats.calls += 1
 #    print "R={1:.4}, a={0}".format(a, compRate)
     return (compRate, a)
 
+def qp_relax_batch(H, P, Ku, stats=None):
+    """
+    Vectorized version of qp_relax for a whole batch of channel vectors.
+    Returns a tuple with the computation rates (its,) and the integer valued coefficient matrix (its, L).
+    Every row gives exactly the same result as qp_relax(H[i], P, Ku, L).
+    A float32 H is computed in float32 (rates in float32), every other H in float64.
+    
+    Parameters
+    ----------
+    H: array-like
+        channel matrix with one channel coefficient vector per row (its, L)
+    P: float
+        Power
+    Ku: int
+        upper bound for K (maximal possible value in aQ)
+    stats: relax_stats
+        collects counters and phase timings if given (None: no instrumentation)
+    """
+    if stats is not None:
+        t0 = timeit.default_timer()
+    prep = qp_relax_prepare(H)
+    if stats is not None:
+        stats.time['sort'] += timeit.default_timer() - t0
+    compRate, a, K = qp_relax_prepared(prep, P, Ku, stats=stats)
+    return (compRate, a)
+
+def qp_relax_prepare(H):
+    """
+    Returns the part of qp_relax_batch which does not depend on the power P (absolute values, signs,
+    sort permutation and norm of every channel vector) as dict for qp_relax_prepared.
+    A power sweep over the same channel vectors only needs it once.
+    
+    Parameters
+    ----------
+    H: array-like
+        channel matrix with one channel coefficient vector per row (its, L), float32 stays float32
+    """
+    H = np.atleast_2d(np.asarray(H))
+    if H.dtype != np.float32:
+        H = np.asarray(H, dtype=float)
+    N, L = H.shape
+    rows = np.arange(N)[:, None]
+    
+    h_abs   = np.absolute(H)
+    t       = np.copysign(np.ones((N, L)), H)    # signs of original channel vectors
+    
+    p = np.argsort(h_abs, axis=1, kind='quicksort') # indexes of sorted channel vectors (per row)
+    return {'h_abs_sorted': h_abs[rows, p], 't': t, 'p': p, 'h_norm2': np.power(H, 2).sum(axis=1)}
+
+def qp_relax_prepared(prep, P, Ku, K_start=None, stats=None):
+    """
+    qp_relax_batch on channel vectors prepared by qp_relax_prepare.
+    Returns a tuple with the computation rates (its,), the integer valued coefficient matrix (its, L)
+    and the K of every row, which can be passed as K_start for the next power of a sweep.
+    
+    Parameters
+    ----------
+    prep: dict
+        result of qp_relax_prepare
+    P: float
+        Power
+    Ku: int
+        upper bound for K (maximal possible value in aQ)
+    K_start: array-like
+        K of every row for a nearby power, only used as starting bracket of the bisection (the K found is the same)
+    stats: relax_stats
+        collects counters and phase timings if given (None: no instrumentation)
+    """
+    if stats is not None:
+        t0 = timeit.default_timer()
+    h_abs_sorted = prep['h_abs_sorted']
+    t = prep['t']
+    p = prep['p']
+    N, L = h_abs_sorted.shape
+    dtype = h_abs_sorted.dtype  # float32 or float64, see qp_relax_prepare
+    rows = np.arange(N)[:, None]
+    
+    b = 1 + P * prep['h_norm2']
+    
+    u = np.sqrt(P/b)[:, None] * h_abs_sorted
+    
+    # r and aC1 as in calc_r and init_aC, for all rows at once
+    r = (u[:, L-1] / (1 - np.power(u[:, 0:L-1], 2).sum(axis=1)))[:, None] * u[:, 0:L-1]
+    aC1 = np.zeros((N, L), dtype=dtype)
+    aC1[:, 0:L-1] = r
+    aC1[:, L-1] = 1
+    
+    if stats is not None:
+        t1 = timeit.default_timer()
+        stats.time['sort'] += t1 - t0
+    
+    """ DETERMINE K """
+    K = _determine_K_batch(aC1, b, Ku, stats, K_start)
+    
+    if stats is not None:
+        t2 = timeit.default_timer()
+        stats.time['K'] += t2 - t1
+        stats.add_K(K)
+    
+    """ Quantization """
+    aQ = np.zeros((N, L), dtype=dtype)
+    aQ[:, L-1] = 1
+    fmin = 1 - _pow2(u[:, L-1])
+    
+    for k in range(1, np.max(K, initial=0)+1):
+        idx = np.nonzero(K >= k)[0]     # rows which still have k in their k_range
+        aC = k * aC1[idx]
+        f = _quantize_scaled(aC, u[idx], L, stats)
+        
+        better = f < fmin[idx]
+        aQ[idx[better]] = aC[better]
+        fmin[idx[better]] = f[better]
+        if stats is not None:
+            stats.k_evals += len(idx)
+            stats.add_improvement(k, np.count_nonzero(better))
+    
+    if stats is not None:
+        t3 = timeit.default_timer()
+        stats.time['quant'] += t3 - t2
+    
+    # recover coefficient vectors
+    a = np.zeros((N, L), dtype=int)
+    a[rows, p] = t[rows, p] * aQ
+    
+    compRate = comp_rate(fmin)
+    if stats is not None:
+        stats.time['sign'] += timeit.default_timer() - t3
+        stats.calls += N
+    return (compRate, a, K)
+
+def qp_relax_multi(H, P, Ku, stats=None):
+    """
+    Coefficient design for compute-and-forward with M relays: relay m runs qp_relax on its channel vector H[..., m, :].
+    All relays of all draws are computed as one batch of qp_relax_batch (the same results as one qp_relax per relay).
+    Returns a tuple with the computation rates of the relays (its, M), the coefficient matrices (its, M, L) with
+    one coefficient vector per relay (row), the sum rates (its,) and the full rank flags (its,) of the coefficient
+    matrices (rank == min(M, L), needed to solve for the messages). For an (M, L) input the leading its axis is dropped.
+    
+    Parameters
+    ----------
+    H: array-like
+        channel matrices (its, M, L) or one channel matrix (M, L), one relay per row
+    P: float
+        Power
+    Ku: int
+        upper bound for K (maximal possible value in aQ)
+    stats: relax_stats
+        collects counters and phase timings if given (None: no instrumentation)
+    """
+    H = np.asarray(H)
+    single = (H.ndim == 2)
+    if single:
+        H = H[None]
+    its, M, L = H.shape
+    compRate, a = qp_relax_batch(H.reshape(its*M, L), P, Ku, stats)
+    compRate = compRate.reshape(its, M)
+    A = a.reshape(its, M, L)
+    sum_rate = compRate.sum(axis=1)
+    full_rank = np.linalg.matrix_rank(A.astype(float)) == min(M, L)
+    if single:
+        return (compRate[0], A[0], sum_rate[0], full_rank[0])
+    return (compRate, A, sum_rate, full_rank)
+
+def _determine_K_batch(aC1, b, Ku, stats=None, K_start=None):
+    """
+    Row wise K determination of qp_relax (same bisection, run for all rows at once).
+    With K_start the bracket of every row starts around K_start[i] instead of [1, Ku]. As nf(K, aC1) grows with K
+    (aC1 >= 0), the bisection finds the same K from any bracket [Kl, Kh] with nf(Kl) < b (or Kl = 1) and nf(Kh) >= b.
+    """
+    N = np.shape(aC1)[0]
+    K = np.full(N, Ku, dtype=int)
+    search = ~(_nf_batch(K, aC1) < b)  # rows which need the bisection
+    Kl = np.ones(N, dtype=int)
+    Kh = np.full(N, Ku, dtype=int)
+    if K_start is not None and Ku > 2:
+        Kl, Kh = _bracket_K(aC1, b, Ku, np.clip(K_start, 1, Ku-1), Kl, Kh, search, stats)
+    active = search & (Kh != (Kl+1))
+    while active.any():
+        Km = fun.fl(0.5*(Kh+Kl))
+        below = _nf_batch(Km, aC1) < b
+        Kl = np.where(active & below, Km, Kl)
+        Kh = np.where(active & ~below, Km, Kh)
+        if stats is not None:
+            stats.bisection_steps += np.count_nonzero(active)
+        active = search & (Kh != (Kl+1))
+    K[search] = Kl[search]
+    return K
+
+def _bracket_K(aC1, b, Ku, Ks, Kl, Kh, search, stats=None):
+    """
+    Returns the bisection bracket (Kl, Kh) of _determine_K_batch narrowed with a guess Ks of the K of every row:
+    nf is tested at Ks and at its neighbour towards the result, a good guess closes the bracket right away.
+    """
+    valid = _nf_batch(Ks, aC1) < b
+    Kl = np.where(valid, Ks, Kl)
+    Kh = np.where(valid, Kh, np.maximum(Ks, Kl+1))
+    # neighbour of the guess: Ks+1 if Ks is below the result, Ks-1 otherwise
+    Kn = np.where(valid, Ks+1, Ks-1)
+    probe = (Kn > Kl) & (Kn < Kh)
+    valid_n = _nf_batch(Kn, aC1) < b
+    Kl = np.where(probe & valid_n, Kn, Kl)
+    Kh = np.where(probe & ~valid_n, np.maximum(Kn, Kl+1), Kh)
+    if stats is not None:
+        stats.bisection_steps += np.count_nonzero(search) + np.count_nonzero(search & probe)
+    return Kl, Kh
+
+def _row_dot(A, B):
+    """
+    Row wise np.dot(A[i], B[i]).
+    BLAS rounds differently for rows which are not 16 byte aligned, so rows of odd length are
+    copied into an even width buffer to give the same result as np.dot on a freshly allocated vector.
+    """
+    N, L = np.shape(A)
+    if L % 2:
+        Ap = np.zeros((N, L+1), dtype=A.dtype)
+        Bp = np.zeros((N, L+1), dtype=B.dtype)
+        Ap[:, 0:L] = A
+        Bp[:, 0:L] = B
+        A = Ap[:, 0:L]
+        B = Bp[:, 0:L]
+    return np.matmul(A[:, None, :], B[:, :, None])[:, 0, 0]
+
+def _pow2(v):
+    """
+    Elementwise v**2 with the same rounding as the scalar expression u[l]**2 in qp_relax.
+    An array exponent keeps numpy from using its fast squaring path for arrays (of the type of v, float32 stays float32).
+    """
+    return np.power(v, np.full(np.shape(v), 2.0, dtype=np.asarray(v).dtype))
+
+def _nf_batch(K, aC1):
+    """ Row wise fun.nf(K[i], aC1[i]) (K*aC1 in the type of aC1) """
+    return np.power(fun.fl(K[:, None].astype(aC1.dtype) * aC1), 2).sum(axis=1)
+
+def quantize_block(aC1, u, K, L, aQ, fmin, stats=None):
+    """
+    Quantization stage of qp_relax for all scalings k*aC1 (k = 1 ... K) at once.
+    The element wise correction runs along l on the (K, L) block, followed by one argmin over f.
+    Returns the same tuple (aQ, fmin) as the sequential k loop in qp_relax.
+    
+    Parameters
+    ----------
+    aC1: np.array
+        normalized initial a (see init_aC)
+    u: np.array
+        normalized channel vector
+    K: int
+        number of scalings of aC1
+    L: int
+        length of aC1
+    aQ: np.array
+        initial coefficient vector, returned if no k*aC1 improves fmin
+    fmin: float
+        initial fmin
+    stats: relax_stats
+        collects counters if given
+    """
+    if K < 1:
+        return aQ, fmin
+    k = np.arange(1, K+1)[:, None]
+    aC = k * aC1    # (K, L)
+    f = _quantize_scaled(aC, u, L, stats)
+    
+    if stats is not None:
+        stats.k_evals += K
+        # improvements of the sequential loop: every f below the running minimum
+        running = np.minimum.accumulate(np.concatenate(([fmin], f)))
+        for k in np.nonzero(f < running[0:K])[0] + 1:
+            stats.add_improvement(k)
+    
+    k_min = np.argmin(f)    # first k with the smallest f, as in the sequential loop
+    if f[k_min] < fmin:
+        aQ = aC[k_min]
+        fmin = f[k_min]
+    return aQ, fmin
+
+def quantize_pruned(aC1, u, K, L, aQ, fmin, stats=None, sort=False):
+    """
+    Quantization of qp_relax which skips the scalings k that cannot improve fmin, same result as the loop over all k.
+    aC1 minimizes f with the last element fixed to 1 and the last element of the quantized k*aC1 stays k, so
+    f(aQ_k) >= k^2 * f(aC1) =: LB_k. k is skipped if LB_k is bigger than fmin by more than the rounding of f.
+    
+    Parameters
+    ----------
+    aC1, u, K, L, aQ, fmin: 
+        as in quantize_block
+    stats: relax_stats
+        collects counters if given, k_skipped counts the skipped k
+    sort: bool
+        False: k = 1 ... K, stops at the first skipped k (LB_k grows with k).
+        True: k in the order of the estimate LB_k + squared distance of k*aC1 to the nearest integers,
+        a small fmin found early skips more k. Ties of f are resolved to the smallest k like the loop.
+    """
+    # python floats: the bound is checked for every k, numpy scalar arithmetic would cost more than it saves
+    aC1_norm2 = float(fun.norm2(aC1))
+    f1 = aC1_norm2 - float(np.dot(aC1, u))**2
+    if sort:
+        k_all = np.arange(1, K+1)
+        frac = k_all[:, None] * aC1[None, 0:L-1]
+        est = k_all**2 * f1 + np.power(frac - np.round(frac), 2).sum(axis=1)
+        k_order = k_all[np.argsort(est, kind='mergesort')].tolist()
+    else:
+        k_order = range(1, K+1)
+    
+    k_best = 0  # k of aQ, 0: initial unit vector
+    for n, k in enumerate(k_order):
+        # rounding of f is far below the margin
+        if k*k * (f1 - 1e-12 * aC1_norm2) - 1e-12 > fmin:
+            if stats is not None:
+                stats.k_skipped += (K - n) if not sort else 1
+            if not sort:
+                break
+            continue
+        aC, f = _quantize_k(aC1, u, k, L, stats)
+        if f < fmin or (f == fmin and k < k_best):
+            aQ = aC
+            fmin = f
+            k_best = k
+            if stats is not None:
+                stats.add_improvement(k)
+        if stats is not None:
+            stats.k_evals += 1
+    return aQ, fmin
+
+def _quantize_k(aC1, u, k, L, stats=None):
+    """ Quantization of k*aC1 with the same steps as the loop in qp_relax, returns the tuple (aC, f) """
+    aC = k * aC1
+    return aC, _quantize_scaled(aC, u, L, stats)
+
+def _quantize_scaled(aC, u, L, stats=None, u2=None, tmp=None):
+    """
+    Floor and correction steps of the quantization in qp_relax on the scaled vector aC = k*aC1 (L,), or row wise on a
+    block of them (n, L) with u (L,) for all rows or (n, L) one per row. Every quantization mode runs these steps.
+    aC is quantized in place, returns f = norm2(aC) - d^2 (float, (n,) for a block).
+    A single vector runs the steps on scalars (the rounding of the scalar expressions), a block on its columns.
+    
+    Parameters
+    ----------
+    u2: np.array
+        _pow2(u) if already computed (qp_relax_ws)
+    tmp: np.array
+        array of the shape of aC for the squares in f (qp_relax_ws), None: allocated
+    """
+    if aC.ndim == 1:
+        d = np.dot(aC, u)
+    else:
+        d = _row_dot(aC, u if u.ndim == 2 else np.tile(u, (len(aC), 1)))
+    if u2 is None:
+        u2 = _pow2(u)
+    aCt, ut, u2t = aC.T, u.T, u2.T    # [l]: element l of the vector, column l of the block
+    for l in range(0, L-1):
+        v = aCt[l]
+        aC_l = np.floor(v)
+        d = d + (aC_l - v) * ut[l]
+        # calculate condition term
+        x = (2*aC_l) - 2*d*ut[l] + 1 - u2t[l]
+        neg = x<0
+        if aC.ndim > 1:
+            aC_l = aC_l + neg
+            d = d + neg * ut[l]
+        elif neg:   # a branch is cheaper than bool arithmetic on scalars
+            aC_l += 1
+            d += ut[l]
+        aCt[l] = aC_l
+        if stats is not None:
+            stats.corrections += np.count_nonzero(neg)
+    return np.power(aC, 2, out=tmp).sum(axis=-1) - _pow2(d)
+
+class relax_stats:
+    """
+    Instrumentation of qp_relax / qp_relax_batch: pass an instance as stats=... to count
+    bisection steps, K, corrections (x<0), evaluated k, skipped k (quantize_pruned), improvements of fmin and the time per phase
+    (sort: sorting/normalization, K: K determination, quant: quantization, sign: sign recovery).
+    """
+    PHASES = ['sort', 'K', 'quant', 'sign']
+    
+    def __init__(self):
+        self.calls = 0              # number of channel vectors
+        self.bisection_steps = 0
+        self.K_hist = {}            # K: number of calls
+        self.corrections = 0        # x<0 corrections in the quantization
+        self.k_evals = 0            # evaluated k*aC1
+        self.k_skipped = 0          # k skipped by the bound of quantize_pruned
+        self.improvements = 0       # f<fmin
+        self.late_improvements = 0  # f<fmin for k>1
+        self.time = dict((phase, 0.0) for phase in self.PHASES)
+    
+    def add_K(self, K):
+        """ Counts the K (int or array of K) of one or more calls """
+        values, counts = np.unique(np.atleast_1d(K), return_counts=True)
+        for value, count in zip(values, counts):
+            self.K_hist[int(value)] = self.K_hist.get(int(value), 0) + int(count)
+    
+    def add_improvement(self, k, n=1):
+        """ Counts n improvements of fmin at scaling k """
+        self.improvements += n
+        if k > 1:
+            self.late_improvements += n
+    
+    def merge(self, other):
+        """ Adds the counters of other (e.g. of another chunk of the same sweep point) """
+        self.calls += other.calls
+        self.bisection_steps += other.bisection_steps
+        for K, count in other.K_hist.items():
+            self.K_hist[K] = self.K_hist.get(K, 0) + count
+        self.corrections += other.corrections
+        self.k_evals += other.k_evals
+        self.k_skipped += other.k_skipped
+        self.improvements += other.improvements
+        self.late_improvements += other.late_improvements
+        for phase in self.PHASES:
+            self.time[phase] += other.time[phase]
+    
+    def summary(self, time_scale=1000):
+        """ Returns a dict with the counters per call and the time per call of each phase (in time_scale) """
+        n = max(self.calls, 1)
+        K_sum = sum(K * count for K, count in self.K_hist.items())
+        res = {
+            'bisect_mean': float(self.bisection_steps) / n,
+            'K_mean': float(K_sum) / n,
+            'K_max': max(self.K_hist.keys()) if self.K_hist else 0,
+            'corr_mean': float(self.corrections) / n,
+            'k_evals_mean': float(self.k_evals) / n,
+            'k_skipped_mean': float(self.k_skipped) / n,
+            'impr_late': float(self.late_improvements) / n,
+        }
+        for phase in self.PHASES:
+            res['t_' + phase] = self.time[phase] / n * time_scale
+        return res
+
+# columns of relax_stats.summary
+STATS_FIELDNAMES = ['bisect_mean', 'K_mean', 'K_max', 'corr_mean', 'k_evals_mean', 'k_skipped_mean', 'impr_late', 't_sort', 't_K', 't_quant', 't_sign']
+
+class qpr_workspace:
+    """
+    Preallocated arrays of qp_relax_ws for channel vectors of length L, hold one per L and reuse it for every call.
+    """
+    def __init__(self, L):
+        self.L = L
+        self.ones = np.ones(L)
+        self.h_abs = np.zeros(L)
+        self.t = np.zeros(L)            # signs of the channel vector
+        self.h_abs_sorted = np.zeros(L)
+        self.u = np.zeros(L)
+        self.aC1 = np.zeros(L)
+        self.aC = np.zeros(L)
+        self.aQ = np.zeros(L)
+        self.tmp = np.zeros(L)
+        self.twos = np.full(L, 2.0)     # exponent of _pow2
+        self.u2 = np.zeros(L)
+
+def qp_relax_ws(h, P, Ku, ws, a_out, stats=None):
+    """
+    qp_relax (loop quantization) on the preallocated arrays of the qpr_workspace ws: the coefficient vector is written
+    into a_out (e.g. a row of the result array) and the computation rate is returned. The only array of length L
+    allocated is the sort permutation. Same results as qp_relax(h, P, Ku, L), the arrays are filled with the same
+    operations in place (the quantization with _quantize_scaled on ws.aC).
+    
+    Parameters
+    ----------
+    h: np.array
+        channel coefficient vector
+    P: float
+        Power
+    Ku: int
+        upper bound for K (maximal possible value in aQ)
+    ws: qpr_workspace
+        workspace of the length of h
+    a_out: np.array
+        coefficient vector (length L) the result is written into
+    stats: relax_stats
+        only the calls are counted
+    """
+    L = ws.L
+    h_abs = np.absolute(h, out=ws.h_abs)
+    t = np.copysign(ws.ones, h, out=ws.t)
+    
+    p = np.argsort(h_abs, kind='quicksort') # indexes of sorted channel vector
+    h_abs_sorted = np.take(h_abs, p, out=ws.h_abs_sorted)
+    
+    b = 1 + P * np.power(h, 2, out=ws.tmp).sum()    # fun.norm2(h)
+    u = np.multiply(np.sqrt(P/b), h_abs_sorted, out=ws.u)
+    
+    # r and aC1 as in calc_r and init_aC
+    aC1 = ws.aC1
+    if (L==2):
+        aC1[0] = u[L-1] / (1-fun.norm2(u[0])) * u[0]
+    else:
+        tmp = ws.tmp[0:L-1]
+        np.power(u[0:L-1], 2, out=tmp)
+        np.multiply(u[L-1] / (1-tmp.sum()), u[0:L-1], out=aC1[0:L-1])
+    aC1[L-1] = 1
+    
+    """ DETERMINE K """
+    if _nf_ws(Ku, aC1, ws.tmp) < b:
+        K = Ku
+    else:
+        Kl = 1
+        while (Ku != (Kl+1)):
+            K = fun.fl(0.5*(Ku+Kl))
+            if _nf_ws(K, aC1, ws.tmp) < b:
+                Kl = K
+            else:
+                Ku = K
+        K = Kl
+    
+    """ Quantization """
+    aQ = ws.aQ
+    aQ.fill(0)
+    aQ[L-1] = 1
+    fmin = 1 - np.power(u[L-1], 2)
+    
+    aC = ws.aC
+    u2 = np.power(u, ws.twos, out=ws.u2)    # _pow2(u)
+    for k in range(1, K+1):
+        np.multiply(k, aC1, out=aC)
+        f = _quantize_scaled(aC, u, L, None, u2, ws.tmp)
+        if f<fmin:
+            aQ[:] = aC
+            fmin = f
+    
+    # recover coefficient vector
+    for l in range(0,L):
+        a_out[p[l]] = t[p[l]] * aQ[l]
+    if stats is not None:
+        stats.calls += 1
+    return comp_rate(fmin)
+
+def _nf_ws(K, aC1, tmp):
+    """ fun.nf(K, aC1) computed in tmp (float instead of int, the sum of the squared small integers is exact) """
+    np.multiply(K, aC1, out=tmp)
+    np.floor(tmp, out=tmp)
+    np.power(tmp, 2, out=tmp)
+    return tmp.sum()
+
 def comp_rate(f):
     return 0.5 * np.log2(1/f)
 
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+
+import math
+import numpy as np
+import qpr_algorithm as alg
+import qpr_fundamentials as fun
+
+try:
+    import numba
+except ImportError:     # the numba engine is only registered if numba is installed
+    numba = None
+
+"""
+Registry of the qp_relax engines, qpr_main picks one by name (par_dict["engine"]).
+Every engine is a function engine(H, P, Ku, stats=None) running qp_relax on all channel vectors
+in the rows of H and returning a tuple with the computation rates (its,) and the coefficient vectors (its, L).
+Engines with the attribute writes_out = True also take out=(cr, a) and write the results into these arrays.
+Engines with the attribute prepared = True give the results of alg.qp_relax_prepared, so a power sweep on the same
+channel vectors (qpr_main.sweep_points) prepares them once for all powers.
+Every engine gives the coefficient vectors of the reference engine, the rates are exactly the same unless the engine
+has the attribute rate_tol (largest allowed rate difference, see check_engine).
+"""
+ENGINES = {}
+# rate tolerance of the numba engine: LLVM may turn pow(x, 2) into x*x and numba's np.dot may sum in another order
+# than numpy's BLAS, so the rates can differ in the last bits (about 1e-12 at high P, where fmin is small)
+RATE_TOL = 1e-10
+
+def register(name, engine):
+    """ Adds engine under name to the registry (replaces an engine with the same name) """
+    ENGINES[name] = engine
+
+def available():
+    """ Returns the names of all registered engines """
+    return sorted(ENGINES.keys())
+
+def get_engine(name):
+    """ Returns the engine registered under name """
+    if name not in ENGINES:
+        raise ValueError("unknown qp_relax engine '{}', available: {}".format(name, ", ".join(available())))
+    return ENGINES[name]
+
+def _relax_loop(H, P, Ku, stats=None, quant="loop"):
+    """ Runs alg.qp_relax on one channel vector after another """
+    N, L = np.shape(H)
+    cr = np.zeros(N)
+    a = np.zeros((N, L), dtype=int)
+    for i in range(0, N):
+        cr[i], a[i] = alg.qp_relax(H[i], P, Ku, L, quant, stats)
+    return cr, a
+
+def reference(H, P, Ku, stats=None):
+    """ Pure Python qp_relax, quantization one k after another """
+    return _relax_loop(H, P, Ku, stats)
+
+def block(H, P, Ku, stats=None):
+    """ qp_relax with all k of the quantization at once (alg.quantize_block) """
+    return _relax_loop(H, P, Ku, stats, "block")
+
+def pruned(H, P, Ku, stats=None):
+    """ qp_relax skipping the k which cannot improve fmin (alg.quantize_pruned) """
+    return _relax_loop(H, P, Ku, stats, "pruned")
+
+def pruned_sorted(H, P, Ku, stats=None):
+    """ qp_relax skipping k, k in the order of their estimated f (alg.quantize_pruned with sort) """
+    return _relax_loop(H, P, Ku, stats, "pruned_sorted")
+
+def workspace(H, P, Ku, stats=None, out=None):
+    """
+    alg.qp_relax_ws on one channel vector after another with one alg.qpr_workspace for all rows.
+    The results are written into out (cr (its,), a (its, L)), e.g. the result arrays of the sweep, if given.
+    """
+    N, L = np.shape(H)
+    if out is None:
+        out = (np.zeros(N), np.zeros((N, L), dtype=int))
+    cr, a = out
+    ws = alg.qpr_workspace(L)
+    for i in range(0, N):
+        cr[i] = alg.qp_relax_ws(H[i], P, Ku, ws, a[i], stats)
+    return cr, a
+workspace.writes_out = True     # run_iterations passes its result arrays as out
+
+def batch(H, P, Ku, stats=None):
+    """ alg.qp_relax_batch on all channel vectors at once """
+    return alg.qp_relax_batch(H, P, Ku, stats)
+batch.prepared = True   # sweep_points runs it as alg.qp_relax_prepare + alg.qp_relax_prepared
+
+def relax_kernel(H, P, Ku, cr, A):
+    """
+    qp_relax on every row of H with scalar loops only (sort, K determination, quantization, sign recovery),
+    written in the subset of Python numba compiles in nopython mode. Results are written into cr (its,) and A (its, L).
+    Squares, sums and dot products use the numpy calls of qp_relax (np.power, sum, np.dot), so the uncompiled kernel
+    gives exactly the results of qp_relax. Compiled, numba may round the last bits differently (see RATE_TOL).
+    """
+    N = H.shape[0]
+    L = H.shape[1]
+    u = np.zeros(L)
+    aC1 = np.zeros(L)
+    aC = np.zeros(L)
+    aQ = np.zeros(L)
+    for i in range(N):
+        # sort and normalize
+        b = 1.0 + P * np.power(H[i], 2).sum()
+        p = np.argsort(np.abs(H[i]))
+        sqrt_P_b = np.sqrt(P / b)
+        for l in range(L):
+            u[l] = sqrt_P_b * abs(H[i, p[l]])
+        r_scale = u[L-1] / (1.0 - np.power(u[0:L-1], 2).sum())
+        for l in range(L-1):
+            aC1[l] = r_scale * u[l]
+        aC1[L-1] = 1.0
+
+        # determine K
+        Kh = Ku
+        if _nf(Kh, aC1, L) < b:
+            K = Kh
+        else:
+            Kl = 1
+            while Kh != Kl + 1:
+                Km = int(np.floor(0.5 * (Kh + Kl)))
+                if _nf(Km, aC1, L) < b:
+                    Kl = Km
+                else:
+                    Kh = Km
+            K = Kl
+
+        # quantization
+        for l in range(L):
+            aQ[l] = 0.0
+        aQ[L-1] = 1.0
+        fmin = 1.0 - np.power(u[L-1], 2)
+        for k in range(1, K+1):
+            for l in range(L):
+                aC[l] = k * aC1[l]
+            d = np.dot(aC, u)
+            for l in range(L-1):
+                v = aC[l]
+                aC[l] = np.floor(aC[l])
+                d += (aC[l] - v) * u[l]
+                x = (2*aC[l]) - 2*d*u[l] + 1 - np.power(u[l], 2)
+                if x < 0:
+                    aC[l] += 1
+                    d += u[l]
+            f = np.power(aC, 2).sum() - np.power(d, 2)
+            if f < fmin:
+                for l in range(L):
+                    aQ[l] = aC[l]
+                fmin = f
+
+        # recover coefficient vector
+        for l in range(L):
+            A[i, p[l]] = math.copysign(1.0, H[i, p[l]]) * aQ[l]
+        cr[i] = 0.5 * np.log2(1.0 / fmin)
+
+def _nf(K, v, L):
+    """ fun.nf(K, v) on scalars """
+    res = 0
+    for l in range(L):
+        x = int(np.floor(K * v[l]))
+        res += x * x
+    return res
+
+def kernel(H, P, Ku, stats=None, compiled=None):
+    """
+    Runs relax_kernel (compiled with numba if installed) on all channel vectors in H.
+    stats is not supported by the kernel, only stats.calls is counted.
+    """
+    H = np.atleast_2d(np.asarray(H, dtype=float))
+    N, L = np.shape(H)
+    cr = np.zeros(N)
+    A = np.zeros((N, L))
+    if compiled is None:
+        compiled = relax_kernel
+    compiled(H, float(P), int(Ku), cr, A)
+    if stats is not None:
+        stats.calls += N
+    return cr, A.astype(int)
+
+register("reference", reference)
+register("block", block)
+register("pruned", pruned)
+register("pruned_sorted", pruned_sorted)
+register("batch", batch)
+register("workspace", workspace)
+register("kernel", kernel)     # uncompiled relax_kernel, slow: only to check the kernel without numba
+
+if numba is not None:
+    _nf = numba.njit(cache=True)(_nf)
+    _relax_kernel_jit = numba.njit(cache=True)(relax_kernel)
+
+    def numba_kernel(H, P, Ku, stats=None):
+        """ relax_kernel compiled with numba in nopython mode """
+        return kernel(H, P, Ku, stats, _relax_kernel_jit)
+    numba_kernel.rate_tol = RATE_TOL
+    register("numba", numba_kernel)
+
+def check_engine(name, L_list=range(2, 17), P_list=(1, 10, 100, 1000), its=200, seed=0):
+    """
+    Compares engine name with the reference engine on random channel vectors (with both signs) and
+    returns a list with one tuple (L, P, number of different coefficient vectors, max rate difference) per point.
+    Raises ValueError if a coefficient vector differs or a rate differs by more than the rate_tol of the engine (0).
+    """
+    engine = get_engine(name)
+    rate_tol = getattr(engine, 'rate_tol', 0)
+    rs = np.random.RandomState(seed)
+    res = []
+    for L in L_list:
+        Ku = fun.choose_Ku(L)
+        for P in P_list:
+            H = rs.standard_normal((its, L))
+            cr_ref, a_ref = reference(H, P, Ku)
+            cr, a = engine(H, P, Ku)
+            n_diff = np.count_nonzero(np.any(a != a_ref, axis=1))
+            res.append((L, P, n_diff, np.max(np.absolute(cr - cr_ref))))
+            if n_diff > 0 or res[-1][3] > rate_tol:
+                raise ValueError("engine '{}' differs from the reference at L={}, P={}: {} different coefficient vectors, "
+                                 "max rate difference {:.3g} (allowed {:.3g})".format(name, L, P, n_diff, res[-1][3], rate_tol))
+    return res
+
+if __name__ == "__main__":
+    # checks every engine against the reference, the numba engine only if numba is installed
+    if numba is None:
+        print("{:>10}: skipped, numba is not installed".format("numba"))
+    for name in available():
+        if name == "reference":
+            continue
+        res = check_engine(name)
+        n_diff = sum(r[2] for r in res)
+        print("{:>10}: {} different coefficient vectors, max rate difference {:.3g}".format(name, n_diff, max(r[3] for r in res)))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import qpr_algorithm as alg
+import qpr_fundamentials as fun
+import qpr_csv_io as qcsv
+import qpr_backends as qbe
+
+# columns of the qpr_timeit files, P and t are read by csv_dict_reader._plot_qpr_timeit
+TIMEIT_FIELDNAMES = ['P', 't', 'name', 'L', 'n', 'p50', 'p95', 'p99', 'calls_per_s', 'items_per_s', 'mismatch']
+
+# modules imported by the simulation workers, they must start without plotting modules
+SIMULATION_MODULES = ['qpr_main', 'qpr_algorithm', 'qpr_backends', 'qpr_csv_io', 'qpr_npz_dump', 'qpr_stats']
+IMPORT_BUDGET_MS = 250      # import time per module in a fresh interpreter (numpy alone takes about 50-100 ms)
+FORBIDDEN_MODULES = ['matplotlib']
+
+def clock_ns():
+    """ Monotonic clock in ns (time.perf_counter_ns if available) """
+    if hasattr(time, 'perf_counter_ns'):
+        return time.perf_counter_ns()
+    return int(timeit.default_timer() * 1e9)
+
+def time_calls(func, args_list):
+    """ Calls func(*args) for every args in args_list and returns the time of each call in ns """
+    t = np.zeros(len(args_list), dtype=np.int64)
+    for i, args in enumerate(args_list):
+        tstart = clock_ns()
+        func(*args)
+        t[i] = clock_ns() - tstart
+    return t
+
+def latency_stats(t_ns, n=1):
+    """
+    Returns a dict with the latency percentiles p50/p95/p99 (in ms), calls/sec and items/sec.
+
+    Parameters
+    ----------
+    t_ns: array-like
+        time of each call in ns
+    n: int
+        number of items (channel vectors, coefficient vectors, rows) handled per call
+    """
+    t_ms = np.asarray(t_ns) / 1e6
+    calls_per_s = len(t_ms) / (np.sum(t_ms) / 1e3)
+    return {'p50': np.percentile(t_ms, 50), 'p95': np.percentile(t_ms, 95), 'p99': np.percentile(t_ms, 99),
+            'mean': np.mean(t_ms), 'calls_per_s': calls_per_s, 'items_per_s': calls_per_s * n}
+
+def bench_qp_relax(L, P, calls, rs, quant="loop"):
+    """ Latency of one qp_relax call """
+    Ku = fun.choose_Ku(L)
+    H = np.absolute(rs.standard_normal((calls, L)))
+    return time_calls(alg.qp_relax, [(h, P, Ku, L, quant) for h in H])
+
+def bench_qp_relax_ws(L, P, calls, rs):
+    """ Latency of one qp_relax_ws call (one workspace and result row for all calls) """
+    Ku = fun.choose_Ku(L)
+    H = np.absolute(rs.standard_normal((calls, L)))
+    ws = alg.qpr_workspace(L)
+    a = np.zeros(L)
+    return time_calls(alg.qp_relax_ws, [(h, P, Ku, ws, a) for h in H])
+
+def bench_qp_relax_batch(L, P, n, calls, rs):
+    """ Latency of one qp_relax_batch call on n channel vectors """
+    Ku = fun.choose_Ku(L)
+    H = [np.absolute(rs.standard_normal((n, L))) for i in range(calls)]
+    return time_calls(alg.qp_relax_batch, [(h, P, Ku) for h in H])
+
+def bench_qp_relax_multi(L, P, n, calls, rs):
+    """ Latency of one qp_relax_multi call on n draws of an (L, L) channel matrix (L relays) """
+    Ku = fun.choose_Ku(L)
+    H = [rs.standard_normal((n, L, L)) for i in range(calls)]
+    return time_calls(alg.qp_relax_multi, [(h, P, Ku) for h in H])
+
+def bench_dtype(L, P, n, calls, rs, dtype=np.float32):
+    """
+    Latency of one qp_relax_batch call on n channel vectors in dtype and the fraction of the channel vectors whose
+    coefficient vector differs from the one computed in float64 (on the same, rounded channel vectors).
+    """
+    Ku = fun.choose_Ku(L)
+    H = [np.absolute(rs.standard_normal((n, L))).astype(dtype) for i in range(calls)]
+    t = time_calls(alg.qp_relax_batch, [(h, P, Ku) for h in H])
+    diff = [np.any(alg.qp_relax_batch(h, P, Ku)[1] != alg.qp_relax_batch(h.astype(float), P, Ku)[1], axis=1) for h in H]
+    return t, np.mean(diff)
+
+def bench_engine(name, L, P, n, calls, rs):
+    """ Latency of one call of the qpr_backends engine name on n channel vectors """
+    Ku = fun.choose_Ku(L)
+    H = [np.absolute(rs.standard_normal((n, L))) for i in range(calls)]
+    engine = qbe.get_engine(name)
+    engine(H[0], P, Ku)     # compiles jit engines before timing
+    return time_calls(engine, [(h, P, Ku) for h in H])
+
+def bench_cnt_appearance(L, P, n, calls, rs, func=fun.cnt_appearance_fast):
+    """ Latency of counting the n coefficient vectors of one (L, P) point """
+    Ku = fun.choose_Ku(L)
+    a = [alg.qp_relax_batch(np.absolute(rs.standard_normal((n, L))), P, Ku)[1].astype(float) for i in range(calls)]
+    return time_calls(func, [(ai,) for ai in a])
+
+def bench_comp_rate(L, P, n, calls, rs):
+    """ Latency of the reference computation rate of n channel vectors with one coefficient vector """
+    H = [np.absolute(rs.standard_normal((n, L))) for i in range(calls)]
+    a = np.ones(L)
+    return time_calls(fun.comp_rate_batch, [(h, a, P, "mean") for h in H])
+
+def bench_write_row(L, P, n, calls, rs):
+    """ Latency of csv_dict_writer.write_row for the results of one (L, P) point with n iterations """
+    Ku = fun.choose_Ku(L)
+    cr, a = alg.qp_relax_batch(np.absolute(rs.standard_normal((n, L))), P, Ku)
+    a_list, a_occ_list = fun.cnt_appearance_fast(a.astype(float))
+    w_dict = {'nr': 0, 'P': P, 'Pdb': 10*np.log10(P), 'h': 'std', 'a': a_list, 'a_occ': a_occ_list,
+              'Rmean': np.mean(cr), 'Rstd': np.std(cr), 'time': 0.0, 'R_ref_av': 0}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        w = qcsv.csv_dict_writer('bench.txt', filedir=tmpdir)
+        t = time_calls(w.write_row, [(w_dict,)] * calls)
+        w.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return t
+
+def run_benchmarks(bench_par):
+    """
+    Runs all benchmarks on the grid of bench_par and returns a list with one result dict per (benchmark, L, P, n).
+    bench_par holds the grid (L_list, P_list, batch_sizes), the number of calls per grid point, the seed
+    and the qpr_backends engines timed in addition (engines).
+    qp_relax_batch_f32 is qp_relax_batch in float32, its mismatch column is the fraction of coefficient vectors
+    which differ from float64 (per L and P: float32 is safe where it is 0).
+    """
+    rs = np.random.RandomState(bench_par["seed"])
+    calls = bench_par["calls"]
+    results = []
+
+    def add(name, L, P, n, t_ns, mismatch=''):
+        res = latency_stats(t_ns, n)
+        res.update({'name': name, 'L': L, 'P': P, 'n': n, 't': res['mean'], 'mismatch': mismatch})
+        results.append(res)
+        print("{name:>20} L={L:<3} P={P:<8.2f} n={n:<6} p50={p50:.4f}ms p95={p95:.4f}ms p99={p99:.4f}ms {calls_per_s:.1f} calls/s {items_per_s:.1f} items/s".format(**res)
+              + ("" if mismatch == '' else " aQ mismatch {:.4%}".format(mismatch)))
+
+    for L in bench_par["L_list"]:
+        for P in bench_par["P_list"]:
+            add('qp_relax', L, P, 1, bench_qp_relax(L, P, calls, rs))
+            add('qp_relax_block', L, P, 1, bench_qp_relax(L, P, calls, rs, quant="block"))
+            add('qp_relax_pruned', L, P, 1, bench_qp_relax(L, P, calls, rs, quant="pruned"))
+            add('qp_relax_ws', L, P, 1, bench_qp_relax_ws(L, P, calls, rs))
+            for n in bench_par["batch_sizes"]:
+                add('qp_relax_batch', L, P, n, bench_qp_relax_batch(L, P, n, calls, rs))
+                add('qp_relax_multi', L, P, n, bench_qp_relax_multi(L, P, n, calls, rs))
+                t_ns, mismatch = bench_dtype(L, P, n, calls, rs)
+                add('qp_relax_batch_f32', L, P, n, t_ns, mismatch)
+                for name in bench_par.get("engines", []):
+                    add('engine_' + name, L, P, n, bench_engine(name, L, P, n, calls, rs))
+        P = bench_par["P_list"][-1]
+        for n in bench_par["batch_sizes"]:
+            add('cnt_appearance_fast', L, P, n, bench_cnt_appearance(L, P, n, calls, rs))
+            add('comp_rate_batch', L, P, n, bench_comp_rate(L, P, n, calls, rs))
+            add('write_row', L, P, n, bench_write_row(L, P, n, calls, rs))
+        # the pairwise counting is slow, only time a few calls of the smallest batch size
+        n = bench_par["batch_sizes"][0]
+        add('cnt_appearance', L, P, n, bench_cnt_appearance(L, P, n, min(calls, 10), rs, fun.cnt_appearance))
+    return results
+
+def import_time(module, repeat=3):
+    """
+    Imports module in fresh interpreters and returns a tuple with the smallest import time in ms (of repeat runs)
+    and the list of FORBIDDEN_MODULES it loaded.
+    """
+    code = ("import sys, timeit; t = timeit.default_timer(); import {}; print(timeit.default_timer() - t); "
+            "print(' '.join(m for m in {!r} if m in sys.modules))").format(module, FORBIDDEN_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', code], cwd=cwd).decode().split('\n')
+        times.append(float(out[0]) * 1e3)
+    return min(times), out[1].split()
+
+def check_import_budget(modules=SIMULATION_MODULES, budget_ms=IMPORT_BUDGET_MS):
+    """
+    Checks the startup cost of the simulation modules: every module must import in less than budget_ms
+    without loading a module of FORBIDDEN_MODULES. Returns the list of failures (empty: all fine).
+    """
+    failures = []
+    for module in modules:
+        t_ms, loaded = import_time(module)
+        print("{:>15}: {:.1f} ms {}".format(module, t_ms, ' '.join(loaded)))
+        if t_ms > budget_ms:
+            failures.append("{} imports in {:.1f} ms > {} ms".format(module, t_ms, budget_ms))
+        if loaded:
+            failures.append("{} loads {}".format(module, ', '.join(loaded)))
+    return failures
+
+def write_timeit(results, filedir='csvfiles'):
+    """ Writes the benchmark results into a qpr_timeit_<date>.txt file (read by csv_dict_reader) """
+    filename = 'qpr_timeit_' + time.strftime("%Y_%m_%d_%H%M%S") + '.txt'
+    w = qcsv.csv_dict_writer(filename, TIMEIT_FIELDNAMES, filedir)
+    for res in results:
+        # write_row writes a sequence one element per line (and a string one character per line): the name is one cell
+        w.write_row(dict((key, [res[key]] if isinstance(res[key], str) else res[key]) for key in TIMEIT_FIELDNAMES))
+    w.close()
+    return filename
+
+if __name__ == '__main__':
+    # python qpr_benchmark.py imports: check the import time budget of the simulation modules only
+    if sys.argv[1:] == ['imports']:
+        failures = check_import_budget()
+        for failure in failures:
+            print(failure)
+        sys.exit(1 if failures else 0)
+    
+    bench_par = {
+        "L_list": [2, 4, 8, 16],
+        "P_list": [1, 10, 100],
+        "batch_sizes": [10, 1000],
+        "calls": 200,       # calls per grid point
+        "seed": 1,
+        "engines": [name for name in ["numba"] if name in qbe.available()],
+    }
+    results = run_benchmarks(bench_par)
+    print("results written to {}".format(write_timeit(results)))
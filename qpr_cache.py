@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+import qpr_fundamentials as fun
+
+"""
+Content addressed cache of the result rows of sweep points (one pickle file per point, named by its key).
+A key is the hash of everything the row of a point depends on: L, P, its, Ku, the settings in KEY_SETTINGS
+(seed, channel options, engine, ...) and the source of the modules computing the row, so the entries of an older
+algorithm are not found any more and are evicted in time (least recently used first).
+The channel vectors of a point only depend on its power (qpr_main.power_seed), not on the other powers of the sweep,
+so a sweep with more powers finds the points of an earlier one.
+"""
+KEY_SETTINGS = ['h', 'h_absolute', 'seed', 'chunk_its', 'shared_channels', 'engine', 'batch', 'quant', 'dtype',
+                'calc_ref', 'calc_opt', 'opt_its', 'instrument', 'time_scale']
+# modules the rows are computed with: channels, engines, rates and rows (qpr_main), optimality gap (qpr_exact)
+ALGORITHM_MODULES = ['qpr_algorithm.py', 'qpr_backends.py', 'qpr_fundamentials.py', 'qpr_main.py', 'qpr_exact.py']
+
+_version = None
+
+def algorithm_version():
+    """ Returns the sha1 of the source of ALGORITHM_MODULES (computed once per process) """
+    global _version
+    if _version is None:
+        sha = hashlib.sha1()
+        moddir = os.path.dirname(os.path.abspath(__file__))
+        for module in ALGORITHM_MODULES:
+            with open(os.path.join(moddir, module), 'rb') as f:
+                sha.update(f.read())
+        _version = sha.hexdigest()
+    return _version
+
+def point_key(par_dict, L, p, its):
+    """
+    Returns the key of the (L, power p) point with its iterations of the sweep par_dict (par_dict["seed"] must be set).
+    """
+    if par_dict.get("seed") is None:
+        raise ValueError("the result cache needs a fixed par_dict['seed'] (points of unseeded runs are never the same)")
+    settings = dict((k, par_dict.get(k)) for k in KEY_SETTINGS)
+    settings['h'] = np.asarray(settings['h']).tolist()
+    settings['seed'] = int(settings['seed'])
+    settings.update({'L': int(L), 'P': repr(float(p)), 'its': int(its), 'Ku': int(fun.choose_Ku(L)),
+                     'version': algorithm_version()})
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+class result_cache:
+    """
+    Result rows of sweep points in the directory cachedir, at most max_mb MB (least recently used entries are removed).
+    The size is scanned once and then counted up with every put, the directory is only scanned again to evict.
+    """
+    def __init__(self, cachedir='cache', max_mb=100):
+        self.cachedir = cachedir
+        self.max_bytes = max_mb * 2**20
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        self.size = sum(e[1] for e in self._entries())
+
+    def path(self, key):
+        return os.path.join(self.cachedir, key + '.pkl')
+
+    def get(self, key):
+        """ Returns the row of key or None if it is not cached """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                row = pickle.load(f)
+            os.utime(path, None)    # mtime is the time of the last use
+        except (IOError, OSError, EOFError):
+            return None
+        return row
+
+    def put(self, key, row):
+        """ Stores row under key and evicts the least recently used entries once the size limit is exceeded """
+        path = self.path(key)
+        if os.path.exists(path):
+            self.size -= os.path.getsize(path)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(row, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(path + '.tmp', path)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """ Returns a list (mtime, size, name) of all entries """
+        entries = []
+        for name in os.listdir(self.cachedir):
+            if name.endswith('.pkl'):
+                try:
+                    st = os.stat(os.path.join(self.cachedir, name))
+                except OSError:     # evicted by another process
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is below its size limit, returns their number """
+        entries = self._entries()
+        size = sum(e[1] for e in entries)
+        n = 0
+        for mtime, nbytes, name in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cachedir, name))
+            except OSError:
+                pass
+            size -= nbytes
+            n += 1
+        self.size = size
+        return n
+
+    def lookup(self, par_dict, L_list, P, its, done=()):
+        """ Returns a dict (L, P index): row with the cached points of the sweep (the points in done are skipped) """
+        rows = {}
+        for L in L_list:
+            for ind, p in enumerate(P):
+                if (L, ind) in done:
+                    continue
+                row = self.get(point_key(par_dict, L, p, its))
+                if row is not None:
+                    row['nr'] = ind     # index of the power in this sweep
+                    rows[(L, ind)] = row
+        return rows
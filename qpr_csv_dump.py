@@ -2,93 +2,26 @@
 
 
 import csv
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 import os
+import numpy as np
+# writer and readers of the result files, here for the scripts importing them from qpr_csv_dump
+from qpr_csv_io import FIELDNAMES, csv_dict_writer, split_comment, parse_vector, qpr_run_reader, _decode
 
-class csv_dict_writer:
-    def __init__(self, filename, fieldnames=None, filedir='csvfiles'):
-        
-        # if fieldnames should be default
-        if fieldnames == None:        
-            self.fieldnames = ['nr', 'P', 'Pdb', 'h', 'a', 'a_occ', 'Rmean', 'Rstd', 'time', 'R_ref_av']
-        else:
-            self.fieldnames = fieldnames
-        
-        # open csvfile
-        self._csvfiledir = filedir
-        self._csvfilename = filename
-        self.csvfile = open(self._csvfiledir + '/' + self._csvfilename, 'w')
-        
-        # make DictWriter
-        self.w = csv.DictWriter(self.csvfile, fieldnames=self.fieldnames, delimiter='\t')
-        
-        # write header first
-        self.w.writeheader()
-        
-        # some needed variables
-        self._FLOATTYPES = [type(float()), type(np.float()), type(np.float128()), type(np.float16()), type(np.float32()), type(np.float64())]
-        self._FLOAT_PRECISION = "{: .6f}"
-    
-    def close(self):
-        self.csvfile.close()
-                
-    def write_row(self, dic):
-        shape_dic = {}  # holds the length of the values in dic (will be updated)
-        max_dic = {}    # holds number of rows for each value in dic (won't be updated)
-        """ generate shape_dic and max_dic with shape and maximum needed row information"""
-        for key in dic.iterkeys():
-            shape_dic[key] = np.shape(dic[key])
-            if shape_dic[key] == ():
-                shape_dic[key] = 1 # number of row is 1
-                max_dic[key] = 1
-            else:
-                shape_dic[key] = shape_dic[key][0]  # number of rows, maximal rows
-                max_dic[key] = shape_dic[key]    # maximum number of rows
-                
-        """ generate print_dic with row print information """
-        print_dic = {}
-        print_new_row = True
-        while print_new_row:
-            for key in dic.iterkeys():
-                if shape_dic[key] == 0: # if already written
-                    print_dic[key] = ''
-                else:
-                    position = max_dic[key] - shape_dic[key]    # calc position with nr of rows - current number
-                    shape_dic[key] -= 1
-                    try:
-                        print_dic[key] = dic[key][position]
-                    except TypeError:
-#                        print "TypeError"
-                        print_dic[key] = dic[key]
-                    except IndexError:
-#                        print "IndexError"
-                        print_dic[key] = dic[key]
-                    
-                    # adjust precision of floats
-                    if type(print_dic[key]) in self._FLOATTYPES:
-                        print_dic[key] = self._FLOAT_PRECISION.format(print_dic[key])
-            if max(shape_dic.values()) == 0:
-                print_new_row = False
-                
-            self.w.writerow(print_dic)
-            
-    def write_parameters(self, par_dict):
-        """
-        Writes settings into csvfile in a comment line
-        """        
-        settings_str = "#iterations={its} pstart={pstart} pend={pend} pnum={pnum} L={L} Ku={Ku} time_scale={time_scale}"
-        settings_str = settings_str.format(**par_dict) + "\n"
-        self.csvfile.write(settings_str)
+def _pyplot():
+    """ Returns matplotlib.pyplot, imported on the first plot only (the simulation never needs matplotlib) """
+    import matplotlib.pyplot as plt
+    return plt
 
 class csv_dict_reader:
-    def __init__(self, plot_par_dict):
+    def __init__(self, plot_par_dict, filename=None, filedir='csvfiles/'):
         self.par = plot_par_dict
 #        self.csvfiledir = 'csvfiles/'        
         
-        # find available files and choose one file to read
-        self.csvfilestring, self.csvfilename = self.choose_csv_file('csvfiles/')
+        # find available files and choose one file to read (no prompt if filename is given)
+        if filename is None:
+            self.csvfilestring, self.csvfilename = self.choose_csv_file(filedir)
+        else:
+            self.csvfilestring, self.csvfilename = os.path.join(filedir, filename), filename
 
         # open file for reading
         self.file = open(self.csvfilestring, 'r')
@@ -134,64 +67,20 @@ class csv_dict_reader:
         """ Returns a dict with parameters """
         print comment_str
 #        par_keys = ['iterations', 'pstart', 'pend', 'pnum', 'L', 'Ku', 'time_scale']
-        # get the string without leading #
-        comment_str = comment_str.split('#')[1]
-        # split all whitespaces and get a list with 'key=value'-pairs
-        comment_list = comment_str.split()
-        
-        dic = {}
-        for element in comment_list:
-            split_list = element.split('=')
-            key = split_list[0]
-            value = float(split_list[1])
-            dic[key] = value
-        return dic
+        return split_comment(comment_str)
         
     def _plot_qpr_run(self):
-        """ Plots R (rate) vs p (power) """
-        _undef_values = ['', None, ' ']
-        first_run = True
-        P = []
-        Rmean = []
-        Rstd = []
-        Pdb = []        
-        Lrange = self.par['Lrange']
-        nr = 0
+        """ Plots R (rate) vs p (power) for all L in Lrange, only these parameter blocks are read (see qpr_run_reader) """
+        filedir, filename = os.path.split(self.csvfilestring)
+        reader = qpr_run_reader(filename, filedir)
+        plt = _pyplot()
         self.fig = plt.figure(num=1)
-        for row in self.r:
-            if self._row_is_comment(row):
-                parameter_dic = self._split_comment(row['nr'])
-                pnum = int(parameter_dic['pnum'])
-                
-            else:
-                L = parameter_dic['L']
-                if L in Lrange:
-                    for key, value in row.iteritems():
-                        if value in _undef_values:
-                            continue
-                        if key == 'P':
-                            P.append(float(value))
-                        elif key == 'Pdb':
-                            Pdb.append(float(value))
-                        elif (key == 'Rmean') or (key == 'R'):
-                            Rmean.append(float(value))
-                        elif (key == 'Rstd'):
-                            Rstd.append(float(value))
-                        elif key == 'nr':
-                            nr = int(value)
-                            
-                if nr == pnum-1:
-                    nr = 0
-                    #print np.random.standard_normal(1)
-                    #print len(Pdb), len(Rmean)
-#                    self.fig = plt.figure(num=L)
-                    self._qpr_run_plotter(Pdb, Rmean, Rstd, parameter_dic)
-                    P = []
-                    Rmean = []
-                    Rstd = []
-                    Pdb = []
-                
-                    
+        for block in range(len(reader.index['blocks'])):
+            parameter_dic = reader.parameters(block)
+            if parameter_dic['L'] in self.par['Lrange']:
+                data = reader.read_block(block)
+                self._qpr_run_plotter(list(data['Pdb']), list(data['Rmean']), list(data['Rstd']), parameter_dic)
+    
     def _read_iteration(self):
         """ """
         iteration_dict = {}        
@@ -208,6 +97,7 @@ class csv_dict_reader:
         return is_comment
 
     def _qpr_run_plotter(self, Pdb, R, Rstd, parameter_dic):       
+        plt = _pyplot()
         ax = plt.gca()
         title_str = "{}\n".format(self.csvfilename) + "{iterations} iterations\nPdB={pstart}->{pend} ({pnum} steps)"
 #        plt.plot(Pdb, R,
@@ -237,11 +127,23 @@ class csv_dict_reader:
 #        ax.yaxis.set_major_formatter(ticker.FormatStrFormatter(('%0.1f')))        
         
     def _plot_qpr_timeit(self):
-        P = []
-        T = []
+        """ Plots t (time per call) vs P, one curve per benchmark, L and batch size n (see qpr_benchmark) """
+        plt = _pyplot()
+        curves = {}
         for row in self.r:
-            P.append(row['P']); T.append(row['t'])
-        plt.plot(P, T)
+            key = (row.get('name'), row.get('L'), row.get('n'))
+            P, T = curves.setdefault(key, ([], []))
+            P.append(float(row['P'])); T.append(float(row['t']))
+        for key in sorted(curves.keys()):
+            P, T = curves[key]
+            label = None
+            if key[0] is not None:
+                label = "{} L={} n={}".format(*[str(k).strip() for k in key])
+            plt.plot(P, T, label=label)
+        plt.xlabel('Power (P)')
+        plt.ylabel('time per call')
+        if len(curves) > 1:
+            plt.legend(loc='upper left')
                        
     def _read_row(self):
         for row in self.r:
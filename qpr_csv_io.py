@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+
+import csv
+import json
+import numpy as np
+import os
+
+"""
+Result file I/O without plotting (numpy and the standard library only), imported by the simulation.
+The plots of the result files are in qpr_csv_dump.
+"""
+
+# default columns of a qpr_run file
+FIELDNAMES = ['nr', 'P', 'Pdb', 'h', 'a', 'a_occ', 'Rmean', 'Rstd', 'time', 'R_ref_av']
+
+class csv_dict_writer:
+    def __init__(self, filename, fieldnames=None, filedir='csvfiles', resume=None):
+        """
+        resume: int
+            continue an existing file: it is cut at the byte offset resume (see checkpoint) and appended to
+        """
+        
+        # if fieldnames should be default
+        if fieldnames == None:        
+            self.fieldnames = list(FIELDNAMES)
+        else:
+            self.fieldnames = fieldnames
+        
+        # open csvfile
+        self._csvfiledir = filedir
+        self._csvfilename = filename
+        if resume is None:
+            self.csvfile = open(self._csvfiledir + '/' + self._csvfilename, 'w')
+        else:
+            # drop everything written after the checkpoint
+            self.csvfile = open(self._csvfiledir + '/' + self._csvfilename, 'r+')
+            self.csvfile.seek(resume)
+            self.csvfile.truncate()
+        
+        # make DictWriter
+        self.w = csv.DictWriter(self.csvfile, fieldnames=self.fieldnames, delimiter='\t')
+        
+        # write header first
+        if resume is None:
+            self.w.writeheader()
+        
+        # some needed variables
+        self._FLOATTYPES = [type(float()), type(np.float()), type(np.float128()), type(np.float16()), type(np.float32()), type(np.float64())]
+        self._FLOAT_PRECISION = "{: .6f}"
+    
+    def close(self):
+        self.csvfile.close()
+    
+    def checkpoint(self):
+        """ Writes everything to disk and returns the byte offset to resume from (csv_dict_writer(..., resume=offset)) """
+        self.csvfile.flush()
+        os.fsync(self.csvfile.fileno())
+        return self.csvfile.tell()
+                
+    def write_row(self, dic):
+        shape_dic = {}  # holds the length of the values in dic (will be updated)
+        max_dic = {}    # holds number of rows for each value in dic (won't be updated)
+        """ generate shape_dic and max_dic with shape and maximum needed row information"""
+        for key in dic.iterkeys():
+            shape_dic[key] = np.shape(dic[key])
+            if shape_dic[key] == ():
+                shape_dic[key] = 1 # number of row is 1
+                max_dic[key] = 1
+            else:
+                shape_dic[key] = shape_dic[key][0]  # number of rows, maximal rows
+                max_dic[key] = shape_dic[key]    # maximum number of rows
+                
+        """ generate print_dic with row print information """
+        print_dic = {}
+        print_new_row = True
+        while print_new_row:
+            for key in dic.iterkeys():
+                if shape_dic[key] == 0: # if already written
+                    print_dic[key] = ''
+                else:
+                    position = max_dic[key] - shape_dic[key]    # calc position with nr of rows - current number
+                    shape_dic[key] -= 1
+                    try:
+                        print_dic[key] = dic[key][position]
+                    except TypeError:
+#                        print "TypeError"
+                        print_dic[key] = dic[key]
+                    except IndexError:
+#                        print "IndexError"
+                        print_dic[key] = dic[key]
+                    
+                    # adjust precision of floats
+                    if type(print_dic[key]) in self._FLOATTYPES:
+                        print_dic[key] = self._FLOAT_PRECISION.format(print_dic[key])
+            if max(shape_dic.values()) == 0:
+                print_new_row = False
+                
+            self.w.writerow(print_dic)
+            
+    def write_parameters(self, par_dict):
+        """
+        Writes settings into csvfile in a comment line
+        """        
+        settings_str = "#iterations={its} pstart={pstart} pend={pend} pnum={pnum} L={L} Ku={Ku} time_scale={time_scale}"
+        settings_str = settings_str.format(**par_dict) + "\n"
+        self.csvfile.write(settings_str)
+
+def split_comment(comment_str):
+    """ Returns a dict with the parameters of a comment line '#iterations=... pstart=... ' """
+    # get the string without leading #
+    comment_str = comment_str.split('#')[1]
+    # split all whitespaces and get a list with 'key=value'-pairs
+    comment_list = comment_str.split()
+    
+    dic = {}
+    for element in comment_list:
+        split_list = element.split('=')
+        key = split_list[0]
+        value = float(split_list[1])
+        dic[key] = value
+    return dic
+
+def parse_vector(vec_str):
+    """ Returns the coefficient vector written as '[ 1.  0.  2.]' as np.array """
+    return np.array(vec_str.strip().strip('[]').split(), dtype=float)
+
+class qpr_run_reader:
+    """
+    Non-interactive reader for qpr_run files written by csv_dict_writer.
+    It keeps an index with the byte offsets of every parameter block (comment line) in a file
+    next to the result file (<file>.idx), so single blocks are read without parsing the whole file.
+    The index is rebuilt when the file changed, or extended when the file only grew (running sweep). Only complete
+    lines are indexed, a line still being written is read by the next scan.
+    """
+    def __init__(self, filename, filedir='csvfiles'):
+        self.filepath = os.path.join(filedir, filename)
+        self.index_path = self.filepath + '.idx'
+        self.index = self._load_index()
+    
+    def _load_index(self):
+        """ Returns the cached index if it is still valid, otherwise (re)builds it """
+        stat = os.stat(self.filepath)
+        index = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                try:
+                    index = json.load(f)
+                except ValueError:
+                    index = None
+        if index is not None and index.get('file_size') == stat.st_size and index['mtime'] == stat.st_mtime:
+            return index
+        # index['size']: offset after the last complete line, file_size: size of the file when it was scanned
+        if index is None or 'file_size' not in index or index['size'] > stat.st_size or not index['blocks']:
+            index = {'fieldnames': None, 'blocks': [], 'size': 0}
+        index = self._scan(index)
+        index['file_size'] = stat.st_size
+        index['mtime'] = stat.st_mtime
+        try:
+            with open(self.index_path, 'w') as f:
+                json.dump(index, f)
+        except IOError:
+            pass    # read only directory: keep the index in memory only
+        return index
+    
+    def _scan(self, index):
+        """ Adds the parameter blocks from byte offset index['size'] on to the index (complete lines only) """
+        blocks = index['blocks']
+        with open(self.filepath, 'rb') as f:
+            offset = index['size']
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break   # still being written, the next scan starts at this line
+                if index['fieldnames'] is None:
+                    index['fieldnames'] = _decode(line).rstrip('\r\n').split('\t')
+                elif line.startswith(b'#'):
+                    if blocks:
+                        blocks[-1]['end'] = offset
+                    blocks.append({'par': split_comment(_decode(line)), 'start': offset + len(line), 'end': None})
+                offset += len(line)
+        if blocks:
+            blocks[-1]['end'] = offset  # last block ends after the last complete line (for now)
+        index['size'] = offset
+        return index
+    
+    def blocks(self, L=None, Ku=None, pnum=None):
+        """ Returns the numbers of the parameter blocks matching L, Ku and pnum (None matches everything) """
+        res = []
+        for i, block in enumerate(self.index['blocks']):
+            par = block['par']
+            if L is not None and par['L'] != L:
+                continue
+            if Ku is not None and par['Ku'] != Ku:
+                continue
+            if pnum is not None and par['pnum'] != pnum:
+                continue
+            res.append(i)
+        return res
+    
+    def parameters(self, block):
+        """ Returns the parameter dict of block number block """
+        return dict(self.index['blocks'][block]['par'])
+    
+    def read_block(self, block, columns=('Pdb', 'Rmean', 'Rstd')):
+        """
+        Reads one parameter block and returns a dict with one entry per (L, P) point for every column.
+        Scalar columns are returned as np.array, 'a' as list (per point) of coefficient vectors and 'a_occ' as list of np.arrays.
+        """
+        entry = self.index['blocks'][block]
+        with open(self.filepath, 'rb') as f:
+            f.seek(entry['start'])
+            text = _decode(f.read(entry['end'] - entry['start']))
+        fieldnames = self.index['fieldnames']
+        # older files use R instead of Rmean
+        columns = [('R' if (c == 'Rmean' and 'Rmean' not in fieldnames) else c) for c in columns]
+        pos = [fieldnames.index(c) for c in columns]
+        nr_pos = fieldnames.index('nr')
+        
+        data = dict((c, []) for c in columns)
+        for row in csv.reader(text.splitlines(True), delimiter='\t'):
+            if len(row) < len(fieldnames):
+                continue    # incomplete last line of a running sweep
+            new_point = row[nr_pos] not in ['', ' ']
+            for c, i in zip(columns, pos):
+                if c in ['a', 'a_occ']:
+                    if new_point:
+                        data[c].append([])
+                    if row[i] not in ['', ' ']:
+                        data[c][-1].append(parse_vector(row[i]) if c == 'a' else int(row[i]))
+                elif new_point:
+                    data[c].append(float(row[i]))
+        for c in columns:
+            if c == 'a_occ':
+                data[c] = [np.array(occ) for occ in data[c]]
+            elif c != 'a':
+                data[c] = np.array(data[c])
+        if 'R' in data:
+            data['Rmean'] = data.pop('R')
+        return data
+    
+    def read_curves(self, L=None, Ku=None, pnum=None, columns=('Pdb', 'Rmean', 'Rstd')):
+        """ Returns a list of tuples (parameter dict, data dict of read_block) for all matching blocks """
+        return [(self.parameters(i), self.read_block(i, columns)) for i in self.blocks(L, Ku, pnum)]
+
+def _decode(line):
+    """ bytes read from the file as str """
+    if isinstance(line, str):
+        return line
+    return line.decode('utf-8')
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import qpr_fundamentials as fun
+import qpr_algorithm as alg
+
+def qp_exact(h, P, a0=None):
+    """
+    Exact solution of the problem qp_relax approximates:
+    minimizes f(a) = norm2(a) - (a^T * u)^2 over all integer vectors a != 0 with a pruned lattice search
+    (sphere decoding, Fincke-Pohst with Schnorr-Euchner ordering of the candidates).
+    Returns a tuple with the optimal computation rate and the optimal coefficient vector a.
+
+    Parameters
+    ----------
+    h: array-like
+        channel coefficient vector
+    P: float
+        Power
+    a0: array-like
+        coefficient vector to start with (e.g. the result of qp_relax), its f is the initial search radius.
+        None: start with the best unit vector
+    """
+    h = np.asarray(h, dtype=float)
+    L = np.size(h)
+
+    h_abs = np.absolute(h)
+    t = np.copysign(np.ones(L), h)  # signs of original channel vector
+    p = np.argsort(h_abs, kind='quicksort')
+
+    b = 1 + P * fun.norm2(h)
+    u = alg.normalize_vector(P, b, h_abs[p])
+
+    # with u >= 0, f(abs(a)) <= f(a): the optimum lies in the non negative orthant
+    if a0 is None:
+        aQ = np.zeros(L)
+        aQ[L-1] = 1
+    else:
+        aQ = np.absolute(np.asarray(a0, dtype=float))[p]
+    fmin = alg.calc_fmin(aQ, u)
+
+    aQ, fmin = sphere_search(u, aQ, fmin)
+
+    # recover coefficient vector
+    a = np.zeros(L)
+    a[p] = t[p] * aQ
+    return alg.comp_rate(fmin), a
+
+def sphere_search(u, a_best, f_best):
+    """
+    Depth first search over the non negative integer vectors a with norm2(R*a) < f_best,
+    where R^T*R = I - u*u^T is the Cholesky factorization of the quadratic form f.
+    Returns the tuple (a, f) with the smallest f found (a_best, f_best if nothing is better).
+
+    Parameters
+    ----------
+    u: np.array
+        normalized channel vector (non negative, norm2(u) < 1)
+    a_best: np.array
+        best known coefficient vector
+    f_best: float
+        f of a_best, initial search radius
+    """
+    L = len(u)
+    G = np.eye(L) - np.outer(u, u)
+    R = np.linalg.cholesky(G).T     # upper triangular
+    R_diag2 = (np.diag(R)**2).tolist()
+    # c_i = -sum_{j>i} R_ij / R_ii * a_j is the center of coordinate i for fixed a_{i+1} ... a_{L-1}
+    R_scaled = (R / np.diag(R)[:, None]).tolist()
+    u_list = u.tolist()
+
+    best = [f_best, list(a_best)]
+    a = [0] * L
+    # slack on the radius, so rounding in the partial distances never prunes the optimum
+    eps = 1e-9
+
+    def search(i, dist):
+        c = 0.0
+        row = R_scaled[i]
+        for j in range(i+1, L):
+            c -= row[j] * a[j]
+        for x in _candidates(c, (best[0] - dist) * (1 + eps) + eps, R_diag2[i]):
+            d = dist + R_diag2[i] * (x - c)**2
+            if d > best[0] * (1 + eps) + eps:
+                break
+            a[i] = x
+            if i > 0:
+                search(i-1, d)
+            elif any(a):
+                # f of the leaf with the same formula as in qp_relax
+                dot = sum(ai * ui for ai, ui in zip(a, u_list))
+                f = sum(ai * ai for ai in a) - dot**2
+                if f < best[0]:
+                    best[0] = f
+                    best[1] = list(a)
+        a[i] = 0
+
+    search(L-1, 0.0)
+    return np.array(best[1], dtype=float), best[0]
+
+def _candidates(c, rad2, r2):
+    """
+    Non negative integers x with r2 * (x - c)^2 <= rad2, in order of increasing distance to c (Schnorr-Euchner).
+    """
+    if rad2 <= 0:
+        return []
+    rad = np.sqrt(rad2 / r2)
+    lo = max(0, int(np.ceil(c - rad)))
+    hi = int(np.floor(c + rad))
+    return sorted(range(lo, hi+1), key=lambda x: abs(x - c))
+
+def optimality_gap(H, P, Ku, cr=None, a=None):
+    """
+    Returns a tuple with the optimal computation rates and the gap R_opt - R_qpr for every channel vector in H.
+
+    Parameters
+    ----------
+    H: array-like
+        channel matrix with one channel coefficient vector per row (its, L)
+    P: float
+        Power
+    Ku: int
+        upper bound for K in qp_relax
+    cr, a: array-like
+        results of qp_relax for H (computation rates (its,) and coefficient vectors (its, L)),
+        calculated with qp_relax_batch if not given
+    """
+    H = np.atleast_2d(H)
+    if cr is None or a is None:
+        cr, a = alg.qp_relax_batch(H, P, Ku)
+    cr = np.ravel(cr)
+    R_opt = np.array([qp_exact(h, P, a_i)[0] for h, a_i in zip(H, a)])
+    # a_i is a feasible start vector, so R_opt < cr is only rounding of the recomputed f
+    R_opt = np.maximum(R_opt, cr)
+    return R_opt, R_opt - cr
+
+if __name__ == "__main__":
+    h = np.array([1.2,0.3,0.8,2.1])
+    print(qp_exact(h, 100))
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 
 
+import json
+import os
 import numpy as np
 
 
@@ -21,25 +23,40 @@ def nf(K, v):
     return norm2( fl(K * v) )
 
 def log2_plus(v):
-    """  Returns the log in respect to base 2, if this is bigger or equal 0, whereas the function returns 0 if it is smaller than 0. """
-    log2_v = np.log2(v)
-    if log2_v < 0:
-        ret_val = 0
-    else:
-        ret_val = log2_v
-    return ret_val
+    """  Returns the log in respect to base 2, if this is bigger or equal 0, whereas the function returns 0 if it is smaller than 0. Works elementwise on arrays. """
+    return np.maximum(np.log2(v), 0)
 
 """ Algorithm specific functions """    
 def choose_Ku(L):
-    """ Returns a upper bound Ku as listed in Table 1 in [1] """
+    """
+    Returns a upper bound Ku as listed in Table 1 in [1].
+    L > 16 are looked up in the table of the Ku tuner (see qpr_ku_tuner, KU_TABLE_FILE), an L which is not tuned gets
+    the Ku of the nearest tuned L (the larger one on a tie). 0 if there is no table.
+    """
     res = 0
     L_Ku_dict = {2:2, 3:3, 4:4, 5:5, 6:5, 7:5, 8:6, 9:6, 10:6, 11:6, 12:7, 13:6, 14:6, 15:6, 16:4}
     if (L in range(2, 17, 1)):
         res = L_Ku_dict[L]
-    else:
-        res = 0
+    elif L > 16 and tuned_Ku_table():
+        table = tuned_Ku_table()
+        nearest = min(table.keys(), key=lambda k: (abs(int(k) - L), -int(k)))
+        res = table[nearest]['Ku']
     return res
 
+# table of qpr_ku_tuner with the Ku for L beyond Table 1 in [1]
+KU_TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'qpr_ku_table.json')
+_ku_table = None    # loaded on the first use
+
+def tuned_Ku_table(reload=False):
+    """ Returns the Ku table of the tuner {str(L): {'Ku': Ku, ...}} from KU_TABLE_FILE (empty if there is none) """
+    global _ku_table
+    if _ku_table is None or reload:
+        _ku_table = {}
+        if os.path.exists(KU_TABLE_FILE):
+            with open(KU_TABLE_FILE, 'r') as f:
+                _ku_table = json.load(f)['L']
+    return _ku_table
+
 def qpr_lin_fit(x, m, n):
     """ Linear function model to fit measuremnt data.  """
     return x*m + n
@@ -71,12 +88,51 @@ def comp_rate_reference(h, a):
     P_NUM = 50
     P = np.logspace(0, 2, num=P_NUM)
     PdB = 10* np.log10(P)
-    compRate_arr = np.zeros(P_NUM)
-    
-    for p_idx, p_val in enumerate(P):
-        compRate_arr[p_idx] = comp_rate(h, a, p_val)    
+    compRate_arr = comp_rate_batch(h, a, P)[0, 0]
     return PdB, compRate_arr
 
+def comp_rate_batch(H, A, P, reduce=None, block=4096):
+    """
+    Calculates the Computation Rate (see comp_rate) for all combinations of channel vectors, coefficient vectors and powers.
+    Returns the rate tensor R[n, m, i] = comp_rate(H[n], A[m], P[i]) with shape (N, M, len(P)),
+    or with reduce="mean" its mean over the channel vectors with shape (M, len(P)),
+    which is accumulated in blocks of channel vectors without building the full tensor.
+    
+    Parameters
+    ----------
+    H: array-like
+        channel vectors (N, L) or a single channel vector (L,)
+    A: array-like
+        coefficient vectors (M, L) or a single coefficient vector (L,)
+    P: float or array-like
+        Power(s)
+    reduce: None or string
+        None: return the full tensor, "mean": average over the channel vectors
+    block: int
+        number of channel vectors processed at once with reduce="mean"
+    """
+    H = np.absolute(np.atleast_2d(H))
+    A = np.absolute(np.atleast_2d(A))
+    P = np.atleast_1d(P)
+    A_norm2 = np.power(A, 2).sum(axis=1)
+    
+    if reduce is None:
+        return _comp_rate_tensor(H, A, A_norm2, P)
+    elif reduce == "mean":
+        R_sum = np.zeros((len(A), len(P)))
+        for start in range(0, len(H), block):
+            R_sum += _comp_rate_tensor(H[start:start+block], A, A_norm2, P).sum(axis=0)
+        return R_sum / len(H)
+    else:
+        raise ValueError("reduce must be None or 'mean', not {}".format(reduce))
+
+def _comp_rate_tensor(H, A, A_norm2, P):
+    """ Rate tensor (N, M, len(P)) of comp_rate_batch for absolute H and A """
+    ha_dot = np.dot(H, A.T)[:, :, None]     # (N, M, 1)
+    H_norm2 = np.power(H, 2).sum(axis=1)[:, None, None]
+    denominator = A_norm2[None, :, None] - ( P * np.power(ha_dot, 2) / (1 + P * H_norm2) )
+    return 0.5 * log2_plus(1 / denominator)
+
 def cnt_cofVec_occ(a, di="increasing"):
     """
     Returns a dict called p_dict which contains data in the following form:
@@ -157,6 +213,91 @@ def cnt_appearance(a, di=True):
             lis.append(ai)
             lis_app.append(1)
     
+    return _sort_appearance(lis, lis_app, di)
+
+def cnt_appearance_fast(a, di=True):
+    """
+    Same as cnt_appearance, but vectorized: every coefficient vector is brought into its sign canonical form
+    (see sign_canonical), so a and -a are counted together, and the rows are counted with np.unique.
+    Returns the same two lists as cnt_appearance (first seen vector of each group and its occurence, same order).
+        
+    Parameters
+    ----------
+    a: array like
+        array of coefficient vectors, which will be counted
+    di: bool
+        True: decreasing, False: increasing order
+    """
+    a = np.asarray(a)
+    if len(a) == 0:
+        return _sort_appearance([], [], di)
+    
+    canon = sign_canonical(a)
+    _, first, counts = np.unique(canon, axis=0, return_index=True, return_counts=True)
+    
+    order = np.argsort(first)   # groups in the order they are seen first
+    lis = [a[i] for i in first[order]]
+    lis_app = [c for c in counts[order]]
+    return _sort_appearance(lis, lis_app, di)
+
+class coef_counter:
+    """
+    Incremental cnt_appearance_fast: counts the coefficient vectors of one point chunk by chunk (add) without keeping
+    the rows, only one vector per group. result() returns the same two lists as cnt_appearance_fast on all rows
+    added (in the order added), the vectors as float like the rows of qp_relax.
+    """
+    def __init__(self, di=True):
+        self.di = di
+        self._index = {}    # canonical vector (bytes) -> group number
+        self._vectors = []  # first seen vector of each group
+        self._counts = []   # occurence of each group
+    
+    def add(self, a, counts=None):
+        """ Counts the coefficient vectors in the rows of a (counts: occurence of each row, default 1) """
+        a = np.asarray(a)
+        if len(a) == 0:
+            return
+        canon = sign_canonical(a).astype(np.int64)
+        _, first, inverse = np.unique(canon, axis=0, return_index=True, return_inverse=True)
+        if counts is None:
+            group_counts = np.bincount(np.ravel(inverse))
+        else:
+            group_counts = np.bincount(np.ravel(inverse), weights=counts).astype(np.int64)
+        for j in np.argsort(first):     # groups in the order they are seen first
+            key = canon[first[j]].tobytes()
+            if key not in self._index:
+                self._index[key] = len(self._vectors)
+                self._vectors.append(np.copy(a[first[j]]))
+                self._counts.append(0)
+            self._counts[self._index[key]] += int(group_counts[j])
+    
+    def merge(self, other):
+        """ Adds the counts of other (vectors counted after the ones of self) """
+        if other._vectors:
+            self.add(np.array(other._vectors), other._counts)
+    
+    def n(self):
+        """ Returns the number of coefficient vectors counted """
+        return sum(self._counts)
+    
+    def result(self):
+        """ Returns the list of coefficient vectors and the list of their occurence (see cnt_appearance) """
+        lis = [np.asarray(v, dtype=float) for v in self._vectors]
+        return _sort_appearance(lis, list(self._counts), self.di)
+
+def sign_canonical(a):
+    """
+    Returns the coefficient vectors (rows of a) multiplied by the sign of their first non zero element,
+    so a and -a have the same canonical form. -0.0 is replaced by 0.0.
+    """
+    a = np.atleast_2d(a)
+    first = np.argmax(a != 0, axis=1)   # index of first non zero element (0 for the zero vector)
+    sign = np.sign(a[np.arange(len(a)), first])
+    sign[sign == 0] = 1
+    return a * sign[:, None] + 0
+
+def _sort_appearance(lis, lis_app, di):
+    """ Sorts the coefficient vectors lis by their occurence lis_app (see cnt_appearance) """
     lis_app_unsort = np.copy(lis_app)
     if di:  # if decreasing order is wanted: negate occurences
         lis_app = np.negative(lis_app)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+
+import json
+import os
+import time
+import numpy as np
+import qpr_algorithm as alg
+import qpr_fundamentials as fun
+
+def measure_Ku(L, P_list, its, Ku_list, seed=0):
+    """
+    Runs qp_relax on the same its standard normal channel vectors (absolute values) for every Ku in Ku_list and P in P_list.
+    Returns a dict Ku: (mean rate per P (len(P_list),), time per call in ms, mean K, mismatch), mismatch is the fraction
+    of the coefficient vectors (of all P) which differ from the ones with the largest Ku of Ku_list.
+    """
+    rs = np.random.RandomState([seed, L])
+    prep = alg.qp_relax_prepare(np.absolute(rs.standard_normal((its, L))))
+    res = {}
+    a_ref = None
+    for Ku in sorted(Ku_list, reverse=True):    # the largest Ku first, it is the reference of the mismatch
+        R = np.zeros(len(P_list))
+        K_sum = 0
+        A = []
+        tstart = time.time()
+        for i, P in enumerate(P_list):
+            cr, a, K = alg.qp_relax_prepared(prep, P, Ku)
+            R[i] = np.mean(cr)
+            K_sum += np.sum(K)
+            A.append(a.astype(np.int8))
+        t = (time.time() - tstart) * 1000 / (its * len(P_list))
+        if a_ref is None:
+            a_ref = A
+        mismatch = np.mean([np.any(a != a0, axis=1).mean() for a, a0 in zip(A, a_ref)])
+        res[Ku] = (R, t, float(K_sum) / (its * len(P_list)), mismatch)
+    return res
+
+def tune_Ku(L, P_list, its=4000, Ku_max=12, tol=0.005, seed=0):
+    """
+    Returns a dict with the smallest Ku whose mean rate is within the relative tolerance tol of the rate with Ku_max
+    at every power in P_list, and the measurements of all candidates (rate loss, time per call, mean K, mismatch).
+    Ku is the main cost/quality knob of qp_relax: it bounds K, the number of scalings k tried in the quantization.
+    Tie rule: candidates within tol are equivalent, the smallest (cheapest) one is taken. If no candidate changes a
+    single coefficient vector (loss and mismatch 0 for all, typical for large L where qp_relax hardly ever finds a
+    better vector than a unit vector), Ku has no effect in the range of P_list and the entry is marked with 'tie'.
+
+    Parameters
+    ----------
+    L: int
+        length of channel vector
+    P_list: array-like
+        powers the rate loss is checked at
+    its: int
+        number of channel vectors (the same for all candidates)
+    Ku_max: int
+        largest candidate, its rates are the reference (candidates are 2 ... Ku_max, Ku=1 ends the K bisection never)
+    tol: float
+        allowed relative rate loss (R(Ku_max) - R(Ku)) / R(Ku_max)
+    """
+    res = measure_Ku(L, P_list, its, range(2, Ku_max+1), seed)
+    R_ref = res[Ku_max][0]
+    candidates = {}
+    Ku_best = Ku_max
+    for Ku in sorted(res.keys(), reverse=True):
+        R, t, K_mean, mismatch = res[Ku]
+        loss = np.max((R_ref - R) / R_ref)
+        candidates[str(Ku)] = {'loss': float(loss), 'time_ms': t, 'K_mean': K_mean, 'mismatch': float(mismatch)}
+        if loss <= tol:
+            Ku_best = Ku
+    tie = all(c['loss'] == 0 and c['mismatch'] == 0 for c in candidates.values())
+    return {'Ku': Ku_best, 'tie': tie, 'candidates': candidates}
+
+def tune_table(L_list, P_list, its=4000, Ku_max=12, tol=0.005, seed=0, filename=None):
+    """
+    Tunes Ku for every L in L_list (see tune_Ku) and writes the results into the table file (default fun.KU_TABLE_FILE)
+    read by fun.choose_Ku, existing entries of other L are kept. Returns the table.
+    """
+    if filename is None:
+        filename = fun.KU_TABLE_FILE
+    table = {'L': {}}
+    if os.path.exists(filename):
+        with open(filename, 'r') as f:
+            table = json.load(f)
+    for L in L_list:
+        entry = tune_Ku(L, P_list, its, Ku_max, tol, seed)
+        entry.update({'P': [float(P_list[0]), float(P_list[-1])], 'its': its, 'tol': tol})
+        table['L'][str(L)] = entry
+        best = entry['candidates'][str(entry['Ku'])]
+        print("L={} Ku={} (loss {:.4f}, mismatch {:.4f}, {:.4f} ms per call){}".format(L, entry['Ku'], best['loss'], best['mismatch'],
+                                                                                  best['time_ms'], " tie" if entry['tie'] else ""))
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    os.rename(filename + '.tmp', filename)
+    if filename == fun.KU_TABLE_FILE:
+        fun.tuned_Ku_table(reload=True)
+    return table
+
+if __name__ == '__main__':
+    tune_par = {
+        # every L up to 32, then every 4th/8th, fun.choose_Ku takes the nearest tuned L for the others
+        "L_list": range(17, 33) + range(36, 65, 4) + range(72, 129, 8),
+        "P_list": np.logspace(0, 2, 5),     # 0 dB ... 20 dB like qpr_main
+        "its": 4000,        # channel vectors per L
+        "Ku_max": 12,       # largest candidate (reference)
+        "tol": 0.005,       # allowed relative rate loss
+        "seed": 0,
+    }
+    tune_table(tune_par["L_list"], tune_par["P_list"], tune_par["its"], tune_par["Ku_max"], tune_par["tol"], tune_par["seed"])
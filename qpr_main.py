@@ -5,45 +5,74 @@ import numpy as np
 import qpr_algorithm as alg
 import qpr_fundamentials as fun
 import time
-import qpr_csv_dump as qcsv
+import os
+import pickle
+import multiprocessing
+import qpr_csv_io as qcsv
+import qpr_npz_dump as qnpz
+import qpr_exact as qex
+import qpr_backends as qbe
+import qpr_stats as qst
+import qpr_cache as qcache
 
 
-def qpr_main(par_dict):
+def qpr_main(par_dict, unit_results=None):
     """
     Runs qpr_relax in 2 loops over L (channel vector length) and P.
     par_dict holds settings for the simulation.
+    With par_dict["workers"] > 0 the (L, P, iteration-chunk) work units are spread over a process pool (see parallel_points).
+    With par_dict["shared_channels"] all P of one L use the same channel vectors (common random numbers, see sweep_points).
+    With par_dict["ci_tol"] the iterations of every point stop early once Rmean is accurate enough (see adaptive_iterations).
+    With par_dict["chunk_size"] every point runs in chunks folded into running results (bounded memory, see stream_point).
+    With par_dict["cache"] the rows of the points are kept in a result cache and points found there are not run again
+    (needs the seeded work units of the process pool, see qpr_cache).
+    With par_dict["checkpoint"] the progress is saved after every point, par_dict["resume"] = 'qpr_run_<date>' continues
+    an interrupted run in the same result file (see save_checkpoint). The checkpoint is removed when the run finishes.
+    unit_results are the results of the work units of parallel_points computed elsewhere (e.g. the shards of qpr_queue),
+    they are written like the results of the process pool.
+    Returns the name of the result file (without extension).
     """
-    date_str = time.strftime("%Y_%m_%d_%H%M%S")
-#    date_str = ""
-    filename = 'qpr_run_' + date_str + '.txt'
-#    fieldnames = ['nr', 'P', 'Pdb', 'h', 'a', 'a_occ', 'R', 'time', 'R_ref']
-    w = qcsv.csv_dict_writer(filename)    
-    
-    # generate P and PdB
-    P = np.logspace(par_dict["pstart"] /10, par_dict["pend"] /10, par_dict["pnum"])
-    Pdb = 10* np.log10(P)
-    
-    # use standard normal distributed channel vector or given vector
-    if np.size(par_dict["h"]) == 1:
-        use_std_normal = True
-        L_list = range(par_dict["Lstart"], par_dict["Lend"]+1, par_dict["Lstep"])
-        its = par_dict["its"]
+    check_modes(par_dict, par_dict.get("workers", 0) > 0 or unit_results is not None)
+    ckpt = None
+    if par_dict.get("resume"):
+        ckpt = load_checkpoint(par_dict["resume"])
+        check_resume(ckpt, par_dict)
+        name = ckpt['name']
+        par_dict["seed"] = ckpt['seed']
+        np.random.set_state(ckpt['rng'])
+        print "resume {} after {} points".format(name, len(ckpt['done']))
     else:
-        use_std_normal = False   # currently not implemented
-        L_list = [np.size(par_dict["h"])]
-        its = 1
+        date_str = time.strftime("%Y_%m_%d_%H%M%S")
+#        date_str = ""
+        name = 'qpr_run_' + date_str
+    w = result_writer(par_dict, name, ckpt['writer'] if ckpt else None)
     
-    # time is in seconds: multiply by time_scale to get ms (1000)
-    time_scale = par_dict["time_scale"]    
+    # finished points (L, P index) and L whose parameters are written already
+    done = set(ckpt['done']) if ckpt else set()
+    params_written = set(ckpt['params_written']) if ckpt else set()
+    
+    P, Pdb, L_list, its = sweep_grid(par_dict)
     
     # dict with results to write in csv file  
     w_dict = {}
     
-    # array to hold cr_ref results before averaging
-    cr_ref  = np.zeros((its, 1))
-    cr_ref_av = 0
+    # rows of the points found in the result cache (L, P index): row
+    cache = None
+    cached = {}
+    if par_dict.get("cache"):
+        if not (par_dict.get("workers", 0) > 0 or unit_results is not None):
+            raise ValueError("cache needs the seeded work units of the process pool (workers > 0)")
+        if par_dict.get("seed") is None:
+            raise ValueError("cache needs a fixed par_dict['seed'], the points of unseeded runs are never the same")
+        cache = qcache.result_cache(par_dict["cache"], par_dict.get("cache_mb", 100))
+        if unit_results is None:    # the units of a queue are fixed already
+            cached = cache.lookup(par_dict, L_list, P, its, done)
+            print "{} points from cache".format(len(cached))
     
-    its_range = range(0, its)
+    # results of the process pool, None for the serial run
+    points = None
+    if par_dict.get("workers", 0) > 0 or unit_results is not None:
+        points = parallel_points(par_dict, L_list, P, its, done | set(cached), unit_results)
     
     """ main loop running algorithm and measure time and plot processing results """
     for L in L_list:
@@ -55,55 +84,491 @@ def qpr_main(par_dict):
         par_dict["Ku"] = Ku # to print in csv file 
         
         # print settings to csv file
-        w.write_parameters(par_dict)
+        if L not in params_written:
+            w.write_parameters(par_dict)
+            params_written.add(L)
+        
+        # channel vectors drawn once for all P (state of the random stream before, to draw them again on resume)
+        sweep = None
+        rng_L = None
+        todo = [ind for ind in range(len(P)) if (L, ind) not in done]
+        if points is None and par_dict.get("shared_channels", False) and todo:
+            rng_L = np.random.get_state()
+            sweep = sweep_points(channels(par_dict, L, its), P[todo], Ku, L, par_dict)
         for ind, p in enumerate(P):   
     #        pdb = 10*np.log10(p)           
-            if use_std_normal:
-                h = np.random.standard_normal(size=(its, L)) 
+            if (L, ind) in done:
+                continue
+            if (L, ind) in cached:
+                w.write_row(cached[(L, ind)])
+                done.add((L, ind))
+                if par_dict.get("checkpoint", False):
+                    save_checkpoint(name, par_dict, done, params_written, np.random.get_state(), w.checkpoint())
+                continue
+            if streaming(par_dict):
+                w.write_row(stream_point(par_dict, ind, p, Pdb[ind], L, Ku, its))
+                done.add((L, ind))
+                if par_dict.get("checkpoint", False):
+                    save_checkpoint(name, par_dict, done, params_written, np.random.get_state(), w.checkpoint())
+                continue
+            if sweep is not None:
+                h, cr, a, time_needed, stats = next(sweep)
+            elif points is None and adaptive(par_dict):
+                stats = new_stats(par_dict)
+                h, cr, a, time_needed = adaptive_iterations(par_dict, L, Ku, p, its, stats)
+            elif points is None:
+                h = channels(par_dict, L, its)
+                stats = new_stats(par_dict)
+                cr, a, time_needed = run_iterations(h, p, Ku, L, par_dict, stats)
             else:
-                h = [ np.array(par_dict["h"]) ]
-                
-            if par_dict["h_absolute"]:
-                    h = np.absolute(h) 
-                
-            cr = np.zeros((its,1))  # array to hold cr values
-            a = np.zeros((its, L))  # array to hold a coefficients
-    
-            """ iteration loop with time measurement"""
-            tstart = time.time()
-            for i in its_range:
-                cr[i], a[i] =  alg.qp_relax(h[i], p, Ku, L)
-                #if np.dot(h[i], a[i]) < 0:
-                #    print "h[i] dot a[i] < 0 !"
-            tend = time.time()
-            time_needed = (tend - tstart) * time_scale
-            
-            # cnt appearance for each choefficient vector
-            a_list, a_occ_list = fun.cnt_appearance(a)
-            cr_mean = np.mean(cr)
-            cr_std = np.std(cr)
-            #cr_max = np.max(cr)
-            #cr_min = np.min(cr)
-            
-            """ Comparison with reference computation rate formula """
-            if par_dict["calc_ref"]:
-                a_most = a_list[0] # most calculated coeff vector
-                for i_h, v_h in enumerate(h):
-                    cr_ref[i_h] = fun.comp_rate(v_h, a_most, p)
-                cr_ref_av = np.average(cr_ref)
-            #print "\t{0}\t{1}\t{2}\t{3}".format(cr_mean, cr_max, cr_min, cr_ref_av)
+                h, cr, a, time_needed, stats = next(points)
             
-            """ Prepare dump dictionary """
-            w_dict = {'nr': ind,'P': p,'Pdb': Pdb[ind], 'a': a_list,'a_occ': a_occ_list, 'Rmean': cr_mean, 'Rstd': cr_std, 'time': time_needed,'R_ref_av': cr_ref_av}
-            if use_std_normal:
-                w_dict['h'] = 'std'
-            else:
-                w_dict['h'] = h
+            w_dict = point_row(par_dict, ind, p, Pdb[ind], h, cr, a, time_needed, stats)
+            if cache is not None:
+                cache.put(qcache.point_key(par_dict, L, p, its), w_dict)
             """ Write dictionary to file """
             w.write_row(w_dict)
+            done.add((L, ind))
+            if par_dict.get("checkpoint", False):
+                # the shared channel vectors of an unfinished L are drawn again on resume
+                rng = rng_L if (rng_L is not None and ind != todo[-1]) else np.random.get_state()
+                save_checkpoint(name, par_dict, done, params_written, rng, w.checkpoint())
         """
         Preprocess with running qpr_csv_dump.py
         """
+    w.close()
+    if os.path.exists(checkpoint_path(name)):
+        os.remove(checkpoint_path(name))    # the run is complete, nothing to resume
+    return name
+
+def check_modes(par_dict, parallel):
+    """
+    Raises ValueError if par_dict combines the serial only modes ci_tol (adaptive iterations) and chunk_size
+    (streaming) with work units (parallel: workers > 0, a queue or unit_results) or shared_channels.
+    """
+    modes = []
+    if adaptive(par_dict):
+        modes.append("ci_tol (adaptive iterations)")
+    if streaming(par_dict):
+        modes.append("chunk_size (streaming)")
+    for mode in modes:
+        if parallel:
+            raise ValueError("{} runs serially only, it cannot be combined with workers={} or a work queue"
+                             .format(mode, par_dict.get("workers", 0)))
+        if par_dict.get("shared_channels", False):
+            raise ValueError("{} cannot be combined with shared_channels".format(mode))
+
+def sweep_grid(par_dict):
+    """ Returns the powers P, the powers in dB, the list of L and the iterations per point of the sweep """
+    # generate P and PdB
+    P = np.logspace(par_dict["pstart"] /10, par_dict["pend"] /10, par_dict["pnum"])
+    Pdb = 10* np.log10(P)
+    
+    # use standard normal distributed channel vector or given vector
+    if use_std_normal(par_dict):
+        L_list = range(par_dict["Lstart"], par_dict["Lend"]+1, par_dict["Lstep"])
+        its = par_dict["its"]
+    else:
+        L_list = [np.size(par_dict["h"])]
+        its = 1
+    return P, Pdb, L_list, its
+
+def result_writer(par_dict, name, resume=None):
+    """
+    Returns the writer for the results: csv_dict_writer (par_dict["store"] = "csv", name.txt)
+    or the binary npz_writer ("npz", name.npz).
+    resume is the writer state of a checkpoint to continue from (None: new file).
+    """
+#    fieldnames = ['nr', 'P', 'Pdb', 'h', 'a', 'a_occ', 'R', 'time', 'R_ref']
+    if par_dict.get("store", "csv") == "npz":
+        return qnpz.npz_writer(name + '.npz', fieldnames(par_dict), resume=resume)
+    return qcsv.csv_dict_writer(name + '.txt', fieldnames(par_dict), resume=resume)
+
+def checkpoint_path(name, filedir='csvfiles'):
+    """ Returns the path of the checkpoint file of the run name """
+    return os.path.join(filedir, name + '.ckpt')
+
+def save_checkpoint(name, par_dict, done, params_written, rng, writer_state, filedir='csvfiles'):
+    """
+    Saves the progress of the run name: finished (L, P index) points, L with written parameters, the state of the
+    global random stream to continue with, the master seed of parallel runs and the writer state.
+    The file is replaced atomically, an interruption while saving keeps the previous checkpoint.
+    """
+    ckpt = {'name': name, 'seed': par_dict.get("seed"), 'done': sorted(done), 'params_written': sorted(params_written),
+            'rng': rng, 'writer': writer_state, 'settings': resume_settings(par_dict)}
+    path = checkpoint_path(name, filedir)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(ckpt, f, 2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path + '.tmp', path)
+
+# settings which must be the same to continue a run from its checkpoint (the seed is taken from the checkpoint)
+RESUME_KEYS = ['pstart', 'pend', 'pnum', 'Lstart', 'Lend', 'Lstep', 'h', 'h_absolute', 'its', 'time_scale', 'calc_ref',
+               'engine', 'batch', 'quant', 'dtype', 'chunk_its', 'chunk_size', 'ci_tol', 'ci_chunk', 'ci_z', 'calc_opt',
+               'opt_its', 'store', 'shared_channels', 'instrument']
+
+def resume_settings(par_dict):
+    """ Returns the settings of RESUME_KEYS in par_dict (serial or parallel run as 'parallel') """
+    settings = dict((key, par_dict.get(key)) for key in RESUME_KEYS)
+    settings['h'] = np.asarray(settings['h']).tolist()
+    settings['parallel'] = par_dict.get("workers", 0) > 0
+    return settings
+
+def check_resume(ckpt, par_dict):
+    """ Raises ValueError if par_dict has other settings (RESUME_KEYS) than the run of the checkpoint ckpt """
+    settings = resume_settings(par_dict)
+    changed = sorted(key for key, value in ckpt['settings'].items() if settings.get(key) != value)
+    if changed:
+        raise ValueError("cannot resume {}, the settings differ from the checkpoint: {}".format(
+            ckpt['name'], ", ".join("{}={!r} (was {!r})".format(key, settings.get(key), ckpt['settings'][key]) for key in changed)))
+
+def load_checkpoint(name, filedir='csvfiles'):
+    """ Returns the checkpoint dict of the run name (see save_checkpoint), the checkpoint of a finished run is removed """
+    if not os.path.exists(checkpoint_path(name, filedir)):
+        raise ValueError("run {} has no checkpoint in {}: it finished already or was not checkpointed".format(name, filedir))
+    with open(checkpoint_path(name, filedir), 'rb') as f:
+        return pickle.load(f)
+
+def fieldnames(par_dict):
+    """ Returns the columns of the result file for the settings in par_dict """
+    names = list(qcsv.FIELDNAMES)
+    if adaptive(par_dict):
+        names.insert(names.index('Rstd')+1, 'its_used')
+    if par_dict.get("calc_opt", False):
+        names += ['Ropt_mean', 'gap_mean']
+    if par_dict.get("instrument", False):
+        names += alg.STATS_FIELDNAMES
+    return names
+
+def new_stats(par_dict):
+    """ Returns a new alg.relax_stats if par_dict["instrument"] is set, None otherwise (no instrumentation) """
+    if par_dict.get("instrument", False):
+        return alg.relax_stats()
+    return None
+
+def use_std_normal(par_dict):
+    """ True if standard normal distributed channel vectors are used, False if the given vector par_dict["h"] is used """
+    return np.size(par_dict["h"]) == 1
+
+def channels(par_dict, L, its, rs=np.random):
+    """
+    Returns its channel vectors of length L in the float type of par_dict["dtype"] (drawn in float64 and rounded,
+    so the random stream is the same for both types).
+    
+    Parameters
+    ----------
+    par_dict: dict
+        simulation settings
+    L: int
+        length of channel vector
+    its: int
+        number of channel vectors
+    rs: np.random.RandomState
+        random stream the standard normal channel vectors are drawn from (default: global numpy random stream)
+    """
+    if use_std_normal(par_dict):
+        h = rs.standard_normal(size=(its, L)).astype(float_dtype(par_dict), copy=False)
+    else:
+        h = [ np.array(par_dict["h"], dtype=float_dtype(par_dict)) ]
+        
+    if par_dict["h_absolute"]:
+            h = np.absolute(h) 
+    return h
+
+def float_dtype(par_dict):
+    """ Returns the float type of the channel vectors and computation rates, par_dict["dtype"] (default float64) """
+    return np.dtype(par_dict.get("dtype") or "float64")
+
+def run_iterations(h, p, Ku, L, par_dict, stats=None, a_dtype=float):
+    """
+    Runs the algorithm on every channel vector in h.
+    Returns a tuple with the computation rates (its, 1), the coefficient vectors (its, L) and the time needed (in time_scale).
+    The counters and phase timings of qp_relax are added to stats (alg.relax_stats) if given.
+    a_dtype is the type of the coefficient vectors (e.g. np.int8, see coef_dtype), the rates have the type of par_dict["dtype"].
+    """
+    its = len(h)
+    cr = np.zeros((its,1), dtype=float_dtype(par_dict))  # array to hold cr values
+    a = np.zeros((its, L), dtype=a_dtype)  # array to hold a coefficients
+    
+    # qp_relax engine (see qpr_backends)
+    engine = qbe.get_engine(engine_name(par_dict))
+    
+    """ iteration loop with time measurement"""
+    tstart = time.time()
+    if getattr(engine, 'writes_out', False):
+        engine(h, p, Ku, stats, out=(cr[:, 0], a))  # writes straight into the rows of cr and a
+    else:
+        cr[:, 0], a[:] = engine(h, p, Ku, stats)
+    tend = time.time()
+    # time is in seconds: multiply by time_scale to get ms (1000)
+    time_needed = (tend - tstart) * par_dict["time_scale"]
+    return cr, a, time_needed
+
+def streaming(par_dict):
+    """ True if the points run in chunks of par_dict["chunk_size"] iterations with bounded memory """
+    return bool(par_dict.get("chunk_size"))
+
+def coef_dtype(Ku):
+    """ Returns the smallest int type holding coefficients up to Ku (the entries of aQ are at most Ku) """
+    if Ku < np.iinfo(np.int8).max:
+        return np.int8
+    return np.int32
+
+def stream_point(par_dict, ind, p, pdb, L, Ku, its):
+    """
+    Runs one (L, P) point in chunks of par_dict["chunk_size"] iterations and returns its row for the result file.
+    Every chunk draws its channel vectors from the global random stream (the same as drawing all at once), runs the
+    engine and is folded into a qst.point_accumulator (running mean/variance of the rates, coefficient vector counts),
+    the coefficient vectors are kept as small ints (coef_dtype). Only one chunk is held in memory.
+    R_ref_av needs the most frequent coefficient vector of the whole point: the chunks are drawn a second time from
+    the saved state of the random stream.
+    With par_dict["ci_tol"] the confidence interval is checked every par_dict["ci_chunk"] iterations like in
+    adaptive_iterations (chunks are cut at these checks), the point stops at the first small enough one.
+    """
+    chunk = par_dict["chunk_size"]
+    ci_chunk = par_dict.get("ci_chunk") or its
+    stats = new_stats(par_dict)
+    acc = qst.point_accumulator()
+    n_opt = par_dict.get("opt_its") or its
+    R_opt, gap = qst.rate_accumulator(), qst.rate_accumulator()
+    rng_start = np.random.get_state()
+    sizes = []
+    while acc.R.n < its:
+        next_check = (acc.R.n // ci_chunk + 1) * ci_chunk if adaptive(par_dict) else its
+        h = channels(par_dict, L, min(chunk, its - acc.R.n, next_check - acc.R.n))
+        cr, a, t = run_iterations(h, p, Ku, L, par_dict, stats, coef_dtype(Ku))
+        sizes.append(len(h))
+        
+        if par_dict.get("calc_opt", False) and acc.R.n < n_opt:
+            k = min(len(h), n_opt - acc.R.n)
+            R_opt_k, gap_k = qex.optimality_gap(h[0:k], p, Ku, cr[0:k], a[0:k])
+            R_opt.add(R_opt_k)
+            gap.add(gap_k)
+        acc.add(cr, a, t)
+        if adaptive(par_dict) and acc.R.n % ci_chunk == 0 and acc.R.n > 1 \
+                and par_dict.get("ci_z", 1.96) * np.sqrt(acc.R.var(1) / acc.R.n) < par_dict["ci_tol"]:
+            break
+    a_list, a_occ_list = acc.coefs.result()
+    
+    if par_dict["calc_ref"]:
+        rng_end = np.random.get_state()
+        np.random.set_state(rng_start)
+        for m in sizes:
+            h = channels(par_dict, L, m)
+            acc.R_ref.add(fun.comp_rate_batch(h, a_list[0], p)[:, 0, 0])
+        np.random.set_state(rng_end)
+    
+    opt = None
+    if par_dict.get("calc_opt", False):
+        opt = (R_opt.mean, gap.mean)
+    return row_dict(par_dict, ind, p, pdb, h, a_list, a_occ_list, acc.R.mean, acc.R.std(), acc.R.n, acc.time, acc.R_ref.mean, opt, stats)
+
+def adaptive(par_dict):
+    """ True if the number of iterations per point is chosen by the confidence interval of Rmean (par_dict["ci_tol"]) """
+    return par_dict.get("ci_tol") is not None
+
+def ci_half_width(cr, z):
+    """ Half width z*std/sqrt(n) of the confidence interval of the mean of the computation rates cr """
+    n = np.size(cr)
+    if n < 2:
+        return np.inf
+    return z * np.std(cr, ddof=1) / np.sqrt(n)
+
+def adaptive_iterations(par_dict, L, Ku, p, its, stats=None):
+    """
+    Runs the iterations of one point in chunks of par_dict["ci_chunk"] channel vectors until the confidence interval
+    half width of Rmean (z = par_dict["ci_z"]) is below par_dict["ci_tol"], at most its iterations.
+    The chunks are drawn one after another from the global random stream, so without early stop the channel
+    vectors are the same as in the fixed its run.
+    Returns a tuple with the channel vectors, the computation rates, the coefficient vectors (only the iterations used)
+    and the time needed.
+    """
+    chunk = par_dict.get("ci_chunk") or its
+    z = par_dict.get("ci_z", 1.96)
+    h_list, cr_list, a_list = [], [], []
+    time_needed = 0
+    n = 0
+    while n < its:
+        h = channels(par_dict, L, min(chunk, its - n))
+        cr, a, t = run_iterations(h, p, Ku, L, par_dict, stats)
+        h_list.append(h)
+        cr_list.append(cr)
+        a_list.append(a)
+        time_needed += t
+        n += len(h)
+        if ci_half_width(np.concatenate(cr_list), z) < par_dict["ci_tol"]:
+            break
+    return np.concatenate(h_list), np.concatenate(cr_list), np.concatenate(a_list), time_needed
+
+def sweep_points(h, P, Ku, L, par_dict):
+    """
+    Generator running the power sweep P on the same channel vectors h (common random numbers) with the engine of par_dict.
+    For engines with prepared = True (batch) the P independent part of qp_relax (sort, signs, norms) is done once with
+    alg.qp_relax_prepare and the K of one power is the starting bracket of the K bisection for the next one, the other
+    engines run every power with run_iterations.
+    Yields (h, cr, a, time_needed, stats) per P like parallel_points, time_needed includes an equal share of the preparation.
+    """
+    if not getattr(qbe.get_engine(engine_name(par_dict)), 'prepared', False):
+        for p in P:
+            stats = new_stats(par_dict)
+            cr, a, time_needed = run_iterations(h, p, Ku, L, par_dict, stats)
+            yield h, cr, a, time_needed, stats
+        return
+    tstart = time.time()
+    prep = alg.qp_relax_prepare(h)
+    time_prep = (time.time() - tstart) * par_dict["time_scale"] / len(P)
+    K = None
+    for p in P:
+        stats = new_stats(par_dict)
+        tstart = time.time()
+        cr, a, K = alg.qp_relax_prepared(prep, p, Ku, K, stats)
+        time_needed = (time.time() - tstart) * par_dict["time_scale"] + time_prep
+        yield h, cr[:, None], a.astype(float), time_needed, stats
+
+def engine_name(par_dict):
+    """ Returns the name of the qp_relax engine, par_dict["engine"] or the one of the older settings "batch"/"quant" """
+    if par_dict.get("engine"):
+        return par_dict["engine"]
+    if par_dict.get("batch", False):
+        return "batch"
+    if par_dict.get("quant", "loop") != "loop":
+        return par_dict["quant"]    # "block", "pruned", "pruned_sorted"
+    return "reference"
+
+def point_row(par_dict, ind, p, pdb, h, cr, a, time_needed, stats=None):
+    """ Returns the dictionary written to the csv file for one (L, P) point (with the instrumentation summary of stats if given) """
+    # cnt appearance for each choefficient vector
+    a_list, a_occ_list = fun.cnt_appearance_fast(a)
+    cr_mean = np.mean(cr)
+    cr_std = np.std(cr)
+    #cr_max = np.max(cr)
+    #cr_min = np.min(cr)
+    
+    """ Comparison with reference computation rate formula """
+    cr_ref_av = 0
+    if par_dict["calc_ref"]:
+        a_most = a_list[0] # most calculated coeff vector
+        cr_ref_av = fun.comp_rate_batch(h, a_most, p, reduce="mean")[0, 0]
+    #print "\t{0}\t{1}\t{2}\t{3}".format(cr_mean, cr_max, cr_min, cr_ref_av)
+    
+    """ Optimality gap of qp_relax against the exact solver (on the first opt_its channel vectors) """
+    opt = None
+    if par_dict.get("calc_opt", False):
+        n_opt = par_dict.get("opt_its") or len(h)
+        R_opt, gap = qex.optimality_gap(h[0:n_opt], p, par_dict["Ku"], cr[0:n_opt], a[0:n_opt])
+        opt = (np.mean(R_opt), np.mean(gap))
+    return row_dict(par_dict, ind, p, pdb, h, a_list, a_occ_list, cr_mean, cr_std, len(cr), time_needed, cr_ref_av, opt, stats)
+
+def row_dict(par_dict, ind, p, pdb, h, a_list, a_occ_list, cr_mean, cr_std, its_used, time_needed, cr_ref_av, opt=None, stats=None):
+    """ Returns the dictionary written to the csv file from the results of one point (opt: mean R_opt and gap or None) """
+    """ Prepare dump dictionary """
+    w_dict = {'nr': ind,'P': p,'Pdb': pdb, 'a': a_list,'a_occ': a_occ_list, 'Rmean': cr_mean, 'Rstd': cr_std, 'time': time_needed,'R_ref_av': cr_ref_av}
+    if adaptive(par_dict):
+        w_dict['its_used'] = its_used
+    if opt is not None:
+        w_dict['Ropt_mean'], w_dict['gap_mean'] = opt
+    if stats is not None:
+        w_dict.update(stats.summary(par_dict["time_scale"]))
+    if use_std_normal(par_dict):
+        w_dict['h'] = 'std'
+    else:
+        w_dict['h'] = h
+    return w_dict
+
+def parallel_points(par_dict, L_list, P, its, done=(), unit_results=None):
+    """
+    Generator running the sweep on a process pool with par_dict["workers"] processes.
+    Every (L, P) point is split into work units of par_dict["chunk_its"] iterations. Each unit draws its
+    channel vectors from its own random stream seeded with [seed, L, power, chunk] (see power_seed), so the results
+    only depend on the master seed par_dict["seed"] and chunk_its, not on the number of workers or the other powers.
+    With par_dict["shared_channels"] a work unit is one (L, iteration-chunk) with the whole power sweep on the
+    channel vectors of the stream [seed, L, chunk] (see sweep_points).
+    The (L, P index) points in done are skipped.
+    Yields (h, cr, a, time_needed, stats) per point in the order of the serial loops, time_needed is the sum over all chunks
+    and stats the merged instrumentation of all chunks (None without par_dict["instrument"]).
+    unit_results are the results of the units of work_units in their order (None: run the units on the pool).
+    """
+    if par_dict.get("seed") is None:
+        par_dict["seed"] = np.random.randint(0, 2**31)
+    print "seed={}".format(par_dict["seed"])
+    units, chunks = work_units(par_dict, L_list, P, its, done)
+    shared = par_dict.get("shared_channels", False)
+    
+    workers = par_dict.get("workers", 0)
+    if unit_results is not None:
+        pool = None
+        results = iter(unit_results)
+    elif workers == 1:
+        pool = None
+        results = (run_unit(unit) for unit in units)
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(run_unit, units)
+    
+    for L in L_list:
+        todo = [ind for ind in range(len(P)) if (L, ind) not in done]
+        if shared and todo:
+            sweeps = [next(results) for c in chunks]
+        for nr_todo, ind in enumerate(todo):
+            if shared:
+                h, cr, a, t, chunk_stats = zip(*[sweep[nr_todo] for sweep in sweeps])
+            else:
+                h, cr, a, t, chunk_stats = zip(*[next(results) for c in chunks])
+            stats = new_stats(par_dict)
+            if stats is not None:
+                for s in chunk_stats:
+                    stats.merge(s)
+            yield np.concatenate(h), np.concatenate(cr), np.concatenate(a), sum(t), stats
+    
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def work_units(par_dict, L_list, P, its, done=()):
+    """
+    Returns the list of work units (par_dict, L, Ku, P index, p, chunk number, iterations) of parallel_points in the
+    order of the serial loops and the list of the (first iteration, iterations) chunks of a point.
+    par_dict["seed"] must be set.
+    """
+    chunk_its = par_dict.get("chunk_its") or its
+    chunks = [(c, min(chunk_its, its - c)) for c in range(0, its, chunk_its)]
+    
+    shared = par_dict.get("shared_channels", False)
+    
+    units = []
+    for L in L_list:
+        Ku = fun.choose_Ku(L)
+        todo = [ind for ind in range(len(P)) if (L, ind) not in done]
+        if shared:
+            if todo:
+                for nr, (c, n) in enumerate(chunks):
+                    units.append((par_dict, L, Ku, None, P[todo], nr, n))
+            continue
+        for ind in todo:
+            p = P[ind]
+            for nr, (c, n) in enumerate(chunks):
+                units.append((par_dict, L, Ku, ind, p, nr, n))
+    return units, chunks
+
+def power_seed(p):
+    """ Returns the power p as seed words (the two 32 bit halves of its float64), the same power gives the same words """
+    return [int(w) for w in np.array([p], dtype=np.float64).view(np.uint32)]
+
+def run_unit(unit):
+    """
+    Runs one work unit (par_dict, L, Ku, P index, p, chunk number, iterations) of parallel_points.
+    A unit with P index None holds all powers in p and returns the list of the sweep_points results.
+    """
+    par_dict, L, Ku, ind, p, nr, n = unit
+    if ind is None:
+        rs = np.random.RandomState([par_dict["seed"], L, nr])
+        return list(sweep_points(channels(par_dict, L, n, rs), p, Ku, L, par_dict))
+    rs = np.random.RandomState([par_dict["seed"], L] + power_seed(p) + [nr])
+    h = channels(par_dict, L, n, rs)
+    stats = new_stats(par_dict)
+    cr, a, time_needed = run_iterations(h, p, Ku, L, par_dict, stats)
+    return h, cr, a, time_needed, stats
 
 #==============================================================================
 #  MAIN
@@ -122,8 +587,26 @@ if __name__ == '__main__':
         "h": np.array([None]),  # None for gaussian channel vector
         "h_absolute": True,     # True: only positive values in channel vector
         "its": 1000,     # number of iterations per setting
+        "ci_tol": None,     # adaptive iterations: stop a point when the confidence interval half width of Rmean is below ci_tol (None: always its)
+        "ci_chunk": 100,    # iterations between two checks of the confidence interval
+        "ci_z": 1.96,       # z of the confidence interval (1.96: 95%)
         "time_scale": 1000, # 1000 for ms, 1 for s ...
         "calc_ref": False,  # 
+        "engine": "reference",  # qp_relax engine (qpr_backends): "reference", "block", "pruned", "pruned_sorted", "batch", "workspace", "numba" (if installed)
+        "workers": 0,       # 0: serial run, >0: number of processes for the (L, P, chunk) work units
+        "seed": None,       # master seed of the work units (None: drawn from numpy random)
+        "chunk_its": 250,   # iterations per work unit
+        "chunk_size": None, # streaming: iterations per chunk of a point, bounds the memory (None: all iterations at once)
+        "calc_opt": False,  # True: compare with the exact solver (qpr_exact) and write the optimality gap
+        "opt_its": None,    # number of iterations per point checked by the exact solver (None: all)
+        "store": "csv",     # result file: "csv" (qpr_run_*.txt) or "npz" (binary, qpr_run_*.npz)
+        "shared_channels": False,   # True: the same channel vectors for all P of one L (common random numbers)
+        "checkpoint": False,    # True: save the progress after every point (csvfiles/qpr_run_<date>.ckpt)
+        "resume": None,     # name of an interrupted run ('qpr_run_<date>') to continue from its checkpoint
+        "instrument": False,    # True: write counters and phase timings of qp_relax per point (alg.relax_stats)
+        "cache": None,      # directory of the result cache of the points, e.g. 'cache' (None: no cache, needs workers > 0 and a seed)
+        "cache_mb": 100,    # size limit of the cache in MB (least recently used points are removed)
+        "dtype": "float64",     # float type of channel vectors and rates: "float32" halves the memory traffic of the "batch" engine (see qpr_benchmark for the aQ mismatch rate)
     }
     
     # run simulation
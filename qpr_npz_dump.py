@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+
+import glob
+import numpy as np
+import os
+
+# parameter columns (name in file, key in par_dict), same settings as the comment line of csv_dict_writer
+PAR_KEYS = [('iterations', 'its'), ('pstart', 'pstart'), ('pend', 'pend'), ('pnum', 'pnum'), ('L', 'L'), ('Ku', 'Ku'), ('time_scale', 'time_scale')]
+
+class npz_writer:
+    """
+    Binary replacement of csv_dict_writer with the same interface (write_parameters, write_row, close).
+    The results are stored as typed arrays in one .npz file:
+        par_<name>      one entry per parameter block (see PAR_KEYS)
+        block           index of the parameter block of each (L, P) point
+        <field>         one entry per point (int64 or float64) for every scalar field of the rows (P, Pdb, Rmean, Rstd, time, R_ref_av, ...)
+        h               channel of each point as text ('std' or the channel vector like [1.0, 2.0])
+        a_ptr           the coefficient vectors of point i are a_occ[a_ptr[i]:a_ptr[i+1]]
+        a_occ           occurence of each coefficient vector
+        a_vec           all coefficient vectors flattened as small ints (vector j is a_vec[a_vec_ptr[j]:a_vec_ptr[j+1]])
+        a_vec_ptr       offsets of the coefficient vectors in a_vec
+    The rows are written incrementally: every part_rows rows and every checkpoint append the rows since the last part
+    as a part file (<file>.part<nr>.npz), so at most part_rows rows are held in memory while the sweep runs. close
+    combines the parts into the .npz file (all columns are read into memory once) and removes them.
+    """
+    def __init__(self, filename, fieldnames=None, filedir='csvfiles', resume=None, part_rows=1000):
+        """
+        resume: dict
+            continue after a checkpoint (the state returned by checkpoint)
+        part_rows: int
+            rows buffered in memory before they are written into a part file
+        """
+        self.fieldnames = fieldnames
+        self.part_rows = part_rows
+        self._filedir = filedir
+        self._filename = filename
+        self.filepath = os.path.join(filedir, filename)
+
+        self._par = dict((name, []) for name, key in PAR_KEYS)
+        self._parts = 0     # number of part files written
+        if resume is not None:
+            self._par = resume['par']
+            self._parts = resume['parts']
+        self._new_part()
+
+    def _new_part(self):
+        """ Starts an empty buffer for the rows of the next part """
+        self._cols = {'block': []}
+        self._a_occ = []
+        self._a_vec = []
+        self._a_ptr = [0]
+        self._a_vec_ptr = [0]
+
+    def part_path(self, nr):
+        """ Returns the path of part file nr """
+        return "{}.part{:05d}.npz".format(self.filepath, nr)
+
+    def write_parameters(self, par_dict):
+        """ Starts a new parameter block """
+        for name, key in PAR_KEYS:
+            self._par[name].append(par_dict[key])
+
+    def write_row(self, dic):
+        """ Appends one (L, P) point; scalar values become columns, 'a'/'a_occ' the coefficient histogram """
+        npoints = len(self._cols['block'])
+        self._cols['block'].append(len(self._par['L']) - 1)
+        for key, value in dic.items():
+            if key in ['a', 'a_occ']:
+                continue
+            if self.fieldnames is not None and key not in self.fieldnames:
+                continue
+            if key == 'h' and not isinstance(value, str):
+                value = str(np.asarray(value).tolist())
+            if key not in self._cols:
+                self._cols[key] = [_missing(value)] * npoints  # column appears later: earlier points have no value
+            self._cols[key].append(value)
+        for key, col in self._cols.items():
+            if len(col) == npoints:
+                col.append(_missing(col[0]))
+
+        for vec, occ in zip(dic['a'], dic['a_occ']):
+            self._a_vec.extend(np.asarray(vec).astype(int).tolist())
+            self._a_vec_ptr.append(len(self._a_vec))
+            self._a_occ.append(occ)
+        self._a_ptr.append(len(self._a_occ))
+        if len(self._cols['block']) >= self.part_rows:
+            self._write_part()
+
+    def _write_part(self):
+        """ Writes the buffered rows into the next part file (pointers local to the part) and empties the buffer """
+        if not self._cols['block']:
+            return
+        arrays = {}
+        for key, col in self._cols.items():
+            arrays[key] = _column(col)
+        arrays['a_vec'] = np.array(self._a_vec, dtype=np.int64)
+        arrays['a_vec_ptr'] = np.array(self._a_vec_ptr, dtype=np.int64)
+        arrays['a_occ'] = np.array(self._a_occ, dtype=np.int64)
+        arrays['a_ptr'] = np.array(self._a_ptr, dtype=np.int64)
+        _savez(self.part_path(self._parts), arrays, np.savez)
+        self._parts += 1
+        self._new_part()
+
+    def flush(self):
+        """ Writes all results so far into the .npz file (the part files are read once) """
+        self._write_part()
+        arrays = {}
+        for name, values in self._par.items():
+            arrays['par_' + name] = np.array(values, dtype=float)
+        parts = []
+        for nr in range(self._parts):
+            with np.load(self.part_path(nr)) as part:
+                parts.append(dict((key, part[key]) for key in part.files))
+        keys = set(key for part in parts for key in part) - set(['a_vec', 'a_vec_ptr', 'a_occ', 'a_ptr'])
+        for key in keys:
+            # a column which appears later has no value in the earlier parts
+            fill = _missing([part[key][0] for part in parts if key in part][0])
+            arrays[key] = np.concatenate([part[key] if key in part else np.array([fill] * len(part['block'])) for part in parts])
+        # pointers of the parts continue after the entries of the parts before
+        a_vec_ptr = [np.zeros(1, dtype=np.int64)]
+        a_ptr = [np.zeros(1, dtype=np.int64)]
+        n_vec = n_occ = 0
+        for part in parts:
+            a_vec_ptr.append(part['a_vec_ptr'][1:] + n_vec)
+            a_ptr.append(part['a_ptr'][1:] + n_occ)
+            n_vec += len(part['a_vec'])
+            n_occ += len(part['a_occ'])
+        a_vec = np.concatenate([part['a_vec'] for part in parts]) if parts else np.zeros(0, dtype=int)
+        vec_dtype = np.int8 if np.all(np.absolute(a_vec) <= 127) else np.int32
+        arrays['a_vec'] = a_vec.astype(vec_dtype)
+        arrays['a_vec_ptr'] = np.concatenate(a_vec_ptr)
+        arrays['a_occ'] = np.concatenate([part['a_occ'] for part in parts]) if parts else np.zeros(0, dtype=np.int64)
+        arrays['a_ptr'] = np.concatenate(a_ptr)
+        if 'block' not in arrays:
+            arrays['block'] = np.zeros(0, dtype=np.int64)
+        _savez(self.filepath, arrays, np.savez_compressed)
+
+    def checkpoint(self):
+        """
+        Appends the rows since the last checkpoint as part file and returns the state to resume from
+        (npz_writer(..., resume=state)), the cost does not grow with the rows written before.
+        """
+        self._write_part()
+        return {'par': self._par, 'parts': self._parts}
+
+    def close(self):
+        self.flush()
+        for path in glob.glob(self.filepath + '.part*.npz'):
+            os.remove(path)
+
+def _missing(value):
+    """ Returns the entry of a point without value in the column of value ('' for text, else nan) """
+    return '' if isinstance(value, (str, np.str_)) else np.nan
+
+def _column(col):
+    """ Returns a list of row values as int64 (block, nr, ...), float64 or text (h) array """
+    col = np.array(col)
+    if col.dtype.kind in 'iu':
+        return col.astype(np.int64)
+    if col.dtype.kind in 'SU':
+        return col
+    return col.astype(float)
+
+def _savez(path, arrays, save):
+    """ Saves arrays with save (np.savez/np.savez_compressed) into path, written to a temporary file first """
+    tmp_path = path + '.tmp.npz'
+    save(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+
+class npz_reader:
+    """
+    Reads .npz result files written by npz_writer. Only the columns asked for are loaded from the file.
+    """
+    def __init__(self, filename, filedir='csvfiles'):
+        self.filepath = os.path.join(filedir, filename)
+        self._npz = np.load(self.filepath)
+        self._loaded = {}   # columns already read from the file
+
+    def columns(self):
+        """ Returns the names of all columns in the file """
+        return list(self._npz.files)
+
+    def column(self, name):
+        """ Returns one column, it is read from the file only once """
+        if name not in self._loaded:
+            self._loaded[name] = self._npz[name]
+        return self._loaded[name]
+
+    def load(self, names):
+        """ Returns a dict with the columns in names (e.g. ['Pdb', 'Rmean', 'Rstd']) """
+        return dict((name, self.column(name)) for name in names)
+
+    def parameters(self, block=None):
+        """ Returns the parameter block(s) as dict of arrays, or as dict of values for one block number """
+        par = dict((name, self.column('par_' + name)) for name, key in PAR_KEYS)
+        if block is not None:
+            par = dict((name, values[block]) for name, values in par.items())
+        return par
+
+    def points(self, L):
+        """ Returns the indexes of all (L, P) points with channel vector length L """
+        return np.nonzero(self.column('par_L')[self.column('block')] == L)[0]
+
+    def histogram(self, point):
+        """ Returns the coefficient vectors and their occurence of one (L, P) point (like cnt_appearance) """
+        a_ptr = self.column('a_ptr')
+        a_vec_ptr = self.column('a_vec_ptr')
+        a_vec = self.column('a_vec')
+        start, end = a_ptr[point], a_ptr[point+1]
+        a_list = [a_vec[a_vec_ptr[j]:a_vec_ptr[j+1]] for j in range(start, end)]
+        return a_list, self.column('a_occ')[start:end]
+
+    def close(self):
+        self._npz.close()
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+
+
+import multiprocessing
+import os
+import pickle
+import sys
+import threading
+import time
+import numpy as np
+import qpr_main
+
+"""
+Work queue of a sweep in a directory shared by all workers (any number of processes on any host with access to it):
+<qdir>/queue.pkl        settings of the sweep (with the seed), number of work units and claim timeout
+<qdir>/todo/<nr>.pkl    work units of qpr_main.work_units waiting for a worker
+<qdir>/claimed/<nr>.pkl units claimed by a worker (moved there with an atomic rename, mtime: time of the claim or of
+                        the last heartbeat of the worker running it)
+<qdir>/shards/<nr>.pkl  results of the units (qpr_main.run_unit)
+Every unit draws its channel vectors from its own seeded random stream, so the merged shards give the same result
+file as qpr_main with the seed of the queue and workers (see qpr_main.parallel_points).
+"""
+SUBDIRS = ['todo', 'claimed', 'shards']
+# s without heartbeat after which a claim counts as abandoned (crashed worker), the worker running a unit touches its
+# claim every timeout/4 s (see _heartbeat), so the timeout does not depend on how long a unit runs
+TIMEOUT = 300
+
+def item_name(nr):
+    """ Returns the file name of work unit nr """
+    return "{:08d}.pkl".format(nr)
+
+def _items(qdir, sub):
+    """ Returns the sorted item names in the sub directory sub of the queue """
+    return sorted(f for f in os.listdir(os.path.join(qdir, sub)) if f.endswith('.pkl'))
+
+def _dump(obj, path):
+    """ Pickles obj into path, written to a temporary file first so readers never see a partial file """
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(path + '.tmp', path)
+
+def _load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def publish(par_dict, qdir, timeout=TIMEOUT):
+    """
+    Expands the sweep of par_dict into the work units of qpr_main.parallel_points (par_dict["chunk_its"] iterations
+    per unit) and writes them into the new queue directory qdir. Draws par_dict["seed"] if it is None.
+    timeout (s) is the claim timeout of the workers of this queue (see reclaim).
+    Returns the number of work units.
+    """
+    qpr_main.check_modes(par_dict, True)
+    if os.path.exists(os.path.join(qdir, 'queue.pkl')):
+        raise ValueError("{} holds a queue already".format(qdir))
+    for sub in SUBDIRS:
+        if not os.path.isdir(os.path.join(qdir, sub)):
+            os.makedirs(os.path.join(qdir, sub))
+    if par_dict.get("seed") is None:
+        par_dict["seed"] = np.random.randint(0, 2**31)
+
+    P, Pdb, L_list, its = qpr_main.sweep_grid(par_dict)
+    units, chunks = qpr_main.work_units(par_dict, L_list, P, its)
+    for nr, unit in enumerate(units):
+        _dump(unit, os.path.join(qdir, 'todo', item_name(nr)))
+    # written last, workers wait for it
+    _dump({'par_dict': par_dict, 'units': len(units), 'timeout': timeout}, os.path.join(qdir, 'queue.pkl'))
+    return len(units)
+
+def reclaim(qdir, timeout=TIMEOUT):
+    """ Moves the claims without heartbeat for timeout seconds (of crashed workers) back to todo, returns their number """
+    n = 0
+    now = time.time()
+    for name in _items(qdir, 'claimed'):
+        path = os.path.join(qdir, 'claimed', name)
+        try:
+            if now - os.path.getmtime(path) > timeout:
+                os.rename(path, os.path.join(qdir, 'todo', name))
+                n += 1
+        except OSError:     # finished or reclaimed by another worker in the meantime
+            pass
+    return n
+
+def claim(qdir, timeout=TIMEOUT):
+    """
+    Claims the next work unit of the queue qdir by moving it from todo to claimed (rename is atomic, only one worker
+    gets it). Abandoned claims (see reclaim) are moved back to todo first.
+    Returns the item name or None if there is nothing to do.
+    """
+    reclaim(qdir, timeout)
+    for name in _items(qdir, 'todo'):
+        path = os.path.join(qdir, 'todo', name)
+        try:
+            os.utime(path, None)    # time of the claim, the rename keeps the mtime
+            os.rename(path, os.path.join(qdir, 'claimed', name))
+        except OSError:     # claimed by another worker
+            continue
+        return name
+    return None
+
+def release(qdir, name):
+    """ Removes the finished work unit name from the queue (from todo as well if its claim was reclaimed) """
+    for sub in ['claimed', 'todo']:
+        try:
+            os.remove(os.path.join(qdir, sub, name))
+        except OSError:
+            pass
+
+def _heartbeat(path, interval, stop):
+    """ Touches the claim path every interval seconds until stop (threading.Event) is set or the claim is gone """
+    while not stop.wait(interval):
+        try:
+            os.utime(path, None)
+        except OSError:     # reclaimed in the meantime
+            return
+
+def work(qdir, timeout=None, poll=1.0):
+    """
+    Worker loop: claims work units of the queue qdir, runs them with qpr_main.run_unit and writes their results into
+    shards until no unit is left in todo or claimed (claims of other workers are waited for, they are run again once
+    they time out). While a unit runs its claim is touched every timeout/4 seconds.
+    timeout: claim timeout in s, None: the one of the queue (see publish)
+    Returns the number of units run by this worker.
+    """
+    while not os.path.exists(os.path.join(qdir, 'queue.pkl')):
+        time.sleep(poll)
+    if timeout is None:
+        timeout = _load(os.path.join(qdir, 'queue.pkl')).get('timeout', TIMEOUT)
+    n = 0
+    while True:
+        name = claim(qdir, timeout)
+        if name is None:
+            if not _items(qdir, 'claimed'):
+                break
+            time.sleep(poll)
+            continue
+        shard = os.path.join(qdir, 'shards', name)
+        if not os.path.exists(shard):   # else finished by a worker whose claim had timed out
+            path = os.path.join(qdir, 'claimed', name)
+            try:
+                unit = _load(path)
+            except (IOError, OSError):  # reclaimed in the meantime
+                continue
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat, args=(path, timeout / 4.0, stop))
+            beat.daemon = True
+            beat.start()
+            try:
+                result = qpr_main.run_unit(unit)
+            finally:
+                stop.set()
+                beat.join()
+            _dump(result, shard)
+            n += 1
+        release(qdir, name)
+    return n
+
+def work_processes(qdir, processes, timeout=None):
+    """ Runs processes workers (see work) on this host and returns the number of units run """
+    pool = multiprocessing.Pool(processes)
+    n = pool.map(_work, [(qdir, timeout)] * processes)
+    pool.close()
+    pool.join()
+    return sum(n)
+
+def _work(args):
+    return work(*args)
+
+def status(qdir):
+    """ Returns a dict with the number of work units in todo, claimed and shards and the total number """
+    res = dict((sub, len(_items(qdir, sub))) for sub in SUBDIRS)
+    res['units'] = _load(os.path.join(qdir, 'queue.pkl'))['units']
+    return res
+
+def merge(qdir):
+    """
+    Writes the results of all shards of the queue qdir into one result file with qpr_main (the same file as
+    qpr_main with the seed of the queue and workers). Raises ValueError if a work unit has no shard yet.
+    Returns the name of the result file.
+    """
+    queue = _load(os.path.join(qdir, 'queue.pkl'))
+    shards = [os.path.join(qdir, 'shards', item_name(nr)) for nr in range(queue['units'])]
+    missing = [path for path in shards if not os.path.exists(path)]
+    if missing:
+        raise ValueError("{} of {} work units of {} have no shard yet".format(len(missing), len(shards), qdir))
+    return qpr_main.qpr_main(queue['par_dict'], (_load(path) for path in shards))
+
+if __name__ == '__main__':
+    # python qpr_queue.py publish <qdir> [timeout]   expands par_dict below into work units (claim timeout in s)
+    # python qpr_queue.py work <qdir> [processes]     runs workers (on every host sharing qdir)
+    # python qpr_queue.py status <qdir>
+    # python qpr_queue.py merge <qdir>               writes the result file into csvfiles/
+    command, qdir = sys.argv[1:3]
+    if command == 'publish':
+        par_dict = {
+            "pstart": 0,    # dB
+            "pend": 20,     # dB
+            "pnum": 100,    # number of points between pstart and pend
+            "Lstart": 2,    # channel and coefficient length START
+            "Lend": 16,     # END
+            "Lstep": 2,     # Stepwidth
+            "h": np.array([None]),  # None for gaussian channel vector
+            "h_absolute": True,     # True: only positive values in channel vector
+            "its": 1000,        # number of iterations per setting
+            "time_scale": 1000, # 1000 for ms, 1 for s ...
+            "calc_ref": False,
+            "engine": "reference",  # qp_relax engine (qpr_backends)
+            "seed": None,       # master seed of the work units (None: drawn from numpy random)
+            "chunk_its": 250,   # iterations per work unit
+            "calc_opt": False,
+            "store": "csv",     # result file of merge: "csv" or "npz"
+            "shared_channels": False,
+            "instrument": False,
+            "dtype": "float64",
+        }
+        timeout = float(sys.argv[3]) if len(sys.argv) > 3 else TIMEOUT
+        print("{} work units published".format(publish(par_dict, qdir, timeout)))
+    elif command == 'work':
+        processes = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        if processes > 1:
+            print("{} work units run".format(work_processes(qdir, processes)))
+        else:
+            print("{} work units run".format(work(qdir)))
+    elif command == 'status':
+        print(status(qdir))
+    elif command == 'merge':
+        print("results written to {}".format(merge(qdir)))
+    else:
+        raise ValueError("unknown command '{}'".format(command))
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+
+import argparse
+import glob
+import multiprocessing
+import os
+import matplotlib
+matplotlib.use('Agg')   # no display needed, must be set before pyplot is imported (by qpr_csv_dump)
+import matplotlib.pyplot as plt
+import qpr_csv_dump as qcsv
+
+# plot settings of csv_dict_reader used for the batch rendering
+PLOT_PAR_DICT = {
+    "Prange": [0, 20, 2],
+    "Lrange": range(2, 17, 1),  # these L values will be plotted
+    "errorbar": True,
+}
+
+def collect_files(paths):
+    """
+    Returns the qpr_run/qpr_timeit result files (.txt/.csv) in paths, sorted.
+    Every path is a result file, a directory (all result files in it) or a glob pattern.
+    """
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = glob.glob(os.path.join(path, '*'))
+        else:
+            candidates = glob.glob(path)
+        for f in candidates:
+            name = os.path.basename(f)
+            if name.split('.', 1)[-1] in ['txt', 'csv'] and (name.startswith('qpr_run') or name.startswith('qpr_timeit')):
+                files.add(f)
+    return sorted(files)
+
+def output_path(filepath, fmt, outdir=None):
+    """ Returns the path of the rendered plot of filepath: <outdir>/<file name without extension>.<fmt> (outdir: next to the file) """
+    if outdir is None:
+        outdir = os.path.dirname(filepath)
+    name = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(outdir, name + '.' + fmt)
+
+def up_to_date(filepath, out_path):
+    """ True if out_path exists and is newer than filepath """
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(filepath)
+
+def render_file(job):
+    """
+    Renders one result file with csv_dict_reader into all output files of job (filepath, out_paths, plot_par_dict).
+    Returns the list of written files.
+    """
+    filepath, out_paths, plot_par_dict = job
+    plt.close('all')
+    filedir, filename = os.path.split(filepath)
+    reader = qcsv.csv_dict_reader(plot_par_dict, filename, filedir)
+    reader.file.close()
+    for out_path in out_paths:
+        plt.savefig(out_path, bbox_inches='tight')
+    plt.close('all')
+    return out_paths
+
+def render_all(paths, formats=('png',), outdir=None, workers=None, plot_par_dict=None, force=False):
+    """
+    Renders all result files in paths (see collect_files) on a process pool with workers processes
+    (None: number of cpus, 0 or 1: in this process). Files whose outputs are all newer than the file are skipped (force: render all).
+    Returns the list of written files.
+    """
+    if plot_par_dict is None:
+        plot_par_dict = PLOT_PAR_DICT
+    if outdir is not None and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    jobs = []
+    for filepath in collect_files(paths):
+        out_paths = [output_path(filepath, fmt, outdir) for fmt in formats]
+        if force or not all(up_to_date(filepath, out_path) for out_path in out_paths):
+            jobs.append((filepath, out_paths, plot_par_dict))
+    if not jobs:
+        return []
+
+    if workers in [0, 1] or len(jobs) == 1:
+        results = [render_file(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.map(render_file, jobs)
+        pool.close()
+        pool.join()
+    return [out_path for out_paths in results for out_path in out_paths]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Renders qpr_run/qpr_timeit result files to image files without display.")
+    parser.add_argument('paths', nargs='*', default=['csvfiles'], help="result files, directories or glob patterns (default: csvfiles)")
+    parser.add_argument('--format', action='append', dest='formats', help="output format, e.g. png or pdf (repeatable, default: png)")
+    parser.add_argument('--outdir', default=None, help="directory of the rendered files (default: next to the result file)")
+    parser.add_argument('--workers', type=int, default=None, help="number of processes (default: number of cpus)")
+    parser.add_argument('--force', action='store_true', help="render also files with up to date outputs")
+    args = parser.parse_args()
+
+    written = render_all(args.paths, args.formats or ['png'], args.outdir, args.workers, force=args.force)
+    print("{} files written".format(len(written)))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+
+import numpy as np
+import qpr_fundamentials as fun
+import qpr_csv_io as qcsv
+
+class rate_accumulator:
+    """
+    Running count, mean, sum of squared deviations (M2), min and max of computation rates.
+    Samples are added in batches (Welford) and two accumulators are combined exactly with merge (Chan et al.),
+    so the result does not depend on how the samples were split into batches, workers or runs.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    @classmethod
+    def from_summary(cls, n, mean, std, vmin=np.inf, vmax=-np.inf):
+        """ Returns an accumulator of n samples with mean and (population) standard deviation std, e.g. a point of a qpr_run file """
+        acc = cls()
+        acc.n = int(n)
+        acc.mean = float(mean)
+        acc.m2 = float(std)**2 * n
+        acc.min = vmin
+        acc.max = vmax
+        return acc
+
+    def add(self, values):
+        """ Adds all samples in values """
+        values = np.ravel(values)
+        if len(values) == 0:
+            return
+        other = rate_accumulator()
+        other.n = len(values)
+        other.mean = np.mean(values)
+        other.m2 = np.sum(np.power(values - other.mean, 2))
+        other.min = np.min(values)
+        other.max = np.max(values)
+        self.merge(other)
+
+    def merge(self, other):
+        """ Adds the samples of the accumulator other """
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean += delta * other.n / n
+        self.m2 += other.m2 + delta**2 * self.n * other.n / n
+        self.n = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def var(self, ddof=0):
+        """ Variance of the samples (ddof=1: unbiased estimate) """
+        if self.n - ddof <= 0:
+            return np.nan
+        return self.m2 / (self.n - ddof)
+
+    def std(self, ddof=0):
+        """ Standard deviation of the samples like np.std(values, ddof=ddof) """
+        return np.sqrt(self.var(ddof))
+
+class point_accumulator:
+    """
+    Results of one (L, P) point built from partial batches: rates R, reference rates R_ref,
+    coefficient vector counts (fun.coef_counter) and the time needed.
+    """
+    def __init__(self):
+        self.R = rate_accumulator()
+        self.R_ref = rate_accumulator()
+        self.coefs = fun.coef_counter()
+        self.time = 0
+
+    def add(self, cr, a, time_needed=0, cr_ref=None):
+        """ Adds one batch: computation rates cr, coefficient vectors a (rows), time and reference rates cr_ref """
+        self.R.add(cr)
+        self.coefs.add(a)
+        self.time += time_needed
+        if cr_ref is not None:
+            self.R_ref.add(cr_ref)
+
+    def merge(self, other):
+        """ Adds the results of other (its coefficient vectors counted after the ones of self) """
+        self.R.merge(other.R)
+        self.R_ref.merge(other.R_ref)
+        self.coefs.merge(other.coefs)
+        self.time += other.time
+
+def read_points(reader, block):
+    """
+    Returns a list with one point_accumulator per point of a parameter block of a qpr_run_reader.
+    R and R_ref are rebuilt from the written means (R_ref_av counts as mean of n samples, std unknown),
+    n is its_used if written, else the iterations of the block.
+    """
+    fieldnames = reader.index['fieldnames']
+    columns = ['Rmean', 'Rstd', 'a', 'a_occ', 'time']
+    if 'R_ref_av' in fieldnames:
+        columns.append('R_ref_av')
+    if 'its_used' in fieldnames:
+        columns.append('its_used')
+    data = reader.read_block(block, columns)
+    its = reader.parameters(block)['iterations']
+    points = []
+    for i in range(len(data['Rmean'])):
+        n = data['its_used'][i] if 'its_used' in data else its
+        acc = point_accumulator()
+        acc.R = rate_accumulator.from_summary(n, data['Rmean'][i], data['Rstd'][i])
+        if 'R_ref_av' in data:
+            acc.R_ref = rate_accumulator.from_summary(n, data['R_ref_av'][i], 0)
+        acc.coefs.add(np.array(data['a'][i]), data['a_occ'][i])
+        acc.time = data['time'][i]
+        points.append(acc)
+    return points
+
+def merge_runs(filenames, out_filename, filedir='csvfiles'):
+    """
+    Combines qpr_run files of the same configuration (independent channel vectors, e.g. runs with different seeds
+    or machines) into one qpr_run file out_filename with the iterations of all runs.
+    Blocks are matched by L, Ku, pstart, pend and pnum, the P points by their position in the block.
+    Returns the number of blocks written.
+    """
+    readers = [qcsv.qpr_run_reader(filename, filedir) for filename in filenames]
+    fieldnames = [c for c in readers[0].index['fieldnames'] if c in qcsv.FIELDNAMES + ['its_used']]
+    w = qcsv.csv_dict_writer(out_filename, fieldnames, filedir)
+
+    n_blocks = 0
+    for block in range(len(readers[0].index['blocks'])):
+        par = readers[0].parameters(block)
+        key = [par[k] for k in ['L', 'Ku', 'pstart', 'pend', 'pnum']]
+        points = read_points(readers[0], block)
+        for reader in readers[1:]:
+            match = [b for b in reader.blocks(par['L'], par['Ku'], par['pnum'])
+                     if [reader.parameters(b)[k] for k in ['L', 'Ku', 'pstart', 'pend', 'pnum']] == key]
+            if not match:
+                raise ValueError("{} has no block with L={} Ku={} pnum={}".format(reader.filepath, par['L'], par['Ku'], par['pnum']))
+            for acc, other in zip(points, read_points(reader, match[0])):
+                acc.merge(other)
+
+        pdb = readers[0].read_block(block, ['P', 'Pdb'])
+        par_dict = dict((k, _number(par[k])) for k in ['pstart', 'pend', 'pnum', 'L', 'Ku', 'time_scale'])
+        par_dict['its'] = max(acc.R.n for acc in points)
+        w.write_parameters(par_dict)
+        for i, acc in enumerate(points):
+            a_list, a_occ_list = acc.coefs.result()
+            w_dict = {'nr': i, 'P': pdb['P'][i], 'Pdb': pdb['Pdb'][i], 'h': 'std', 'a': a_list, 'a_occ': a_occ_list,
+                      'Rmean': acc.R.mean, 'Rstd': acc.R.std(), 'time': acc.time, 'R_ref_av': acc.R_ref.mean}
+            if 'its_used' in fieldnames:
+                w_dict['its_used'] = acc.R.n
+            w.write_row(dict((k, v) for k, v in w_dict.items() if k in fieldnames))
+        n_blocks += 1
+    w.close()
+    return n_blocks
+
+def _number(v):
+    """ v as int if it is integral (as written by qpr_main), else as float """
+    if v == int(v):
+        return int(v)
+    return v
+
+if __name__ == "__main__":
+    import sys
+    # python qpr_stats.py out_file run_file1 run_file2 ...   (files in csvfiles/)
+    print("{} blocks merged".format(merge_runs(sys.argv[2:], sys.argv[1])))